@@ -0,0 +1,238 @@
+# times and memory-profiles the generation hot paths on synthetic workspaces, cold and warm
+# python benchmarks/suite.py [--scale 0.1] [--json out.json] [--compare base.json]
+from pathlib import Path
+import contextlib
+import subprocess
+import tracemalloc
+import argparse
+import tempfile
+import platform
+import shutil
+import json
+import time
+import sys
+import io
+import os
+
+import jmake
+from jmake import generator
+from jmake import builder
+from jmake import output
+
+VERSION = 1
+
+
+def project(name, target, count):
+    p = jmake.Project(name, target)
+    p.add([ f"src/{name}/dir{i // 100}/file{i}.cpp" for i in range(count) ])
+    p.include([ f"src/{name}", "include" ])
+    p.define(name.upper(), True)
+    p.compile("-Wall")
+    f = p.filter("release")
+    f["optimization"] = True
+    f.define("NDEBUG", True)
+    return p
+
+
+# many small projects, every tenth one depends on the previous ten
+def many(scale):
+    ws = jmake.Workspace("many")
+    count = max(int(500 * scale), 2)
+    projects = []
+    for i in range(count):
+        p = project(f"lib{i}", jmake.Target.STATIC_LIBRARY, 40)
+        if i % 10 == 9:
+            p.depend(projects[-9:])
+        projects.append(p)
+    app = project("app", jmake.Target.EXECUTABLE, 10)
+    app.depend(projects[9::10])
+    ws.add(app)
+    return ws
+
+
+# a few projects with 10k+ files each
+def large(scale):
+    ws = jmake.Workspace("large")
+    count = max(int(12000 * scale), 10)
+    core = project("core", jmake.Target.STATIC_LIBRARY, count)
+    app = project("app", jmake.Target.EXECUTABLE, count)
+    app.depend(core)
+    ws.add(app)
+    return ws
+
+
+# static libraries each depending on the previous one, resolving options walks the whole chain
+def chain(scale):
+    ws = jmake.Workspace("chain")
+    depth = max(int(200 * scale), 2)
+    prev = None
+    for i in range(depth):
+        p = project(f"link{i}", jmake.Target.STATIC_LIBRARY, 20)
+        p.depend(prev)
+        prev = p
+    app = project("app", jmake.Target.EXECUTABLE, 10)
+    app.depend(prev)
+    ws.add(app)
+    return ws
+
+
+# many libraries sharing one base, one executable links all of them
+def fanin(scale):
+    ws = jmake.Workspace("fanin")
+    width = max(int(300 * scale), 2)
+    base = project("base", jmake.Target.STATIC_LIBRARY, 50)
+    libs = []
+    for i in range(width):
+        p = project(f"leaf{i}", jmake.Target.STATIC_LIBRARY, 20)
+        p.depend(base)
+        libs.append(p)
+    app = project("app", jmake.Target.EXECUTABLE, 10)
+    app.depend(libs)
+    ws.add(app)
+    return ws
+
+
+shapes = {
+        "many": many,
+        "large": large,
+        "chain": chain,
+        "fanin": fanin
+        }
+
+
+def invalidate():
+    jmake.Project._generation += 1
+
+
+def options(ws):
+    for p in ws._projects.values():
+        p.options(ws._configs)
+
+
+def clean():
+    host = jmake.Env()
+    shutil.rmtree(host.bin, ignore_errors=True)
+    Path(host.bin, "jmake").mkdir(parents=True)
+
+
+def get_cached(ws):
+    generator.get_cached(ws)
+
+
+def drop_cache():
+    Path(jmake.Env().bin, "jmake", "cache.jml").unlink(missing_ok=True)
+
+
+def backend(name):
+    def func(ws):
+        output.manifest = output.Manifest()
+        generator.factory(name).generate(ws)
+    return func
+
+
+def plan(ws):
+    builder.Builder(ws, "debug").plan()
+
+
+# tuple(name, func, setup per state), a warm run reuses whatever the previous run left behind
+# a cold run also drops the options cached in memory, otherwise only the files would be cold
+benches = [
+        ("options", options, { "cold": invalidate, "warm": None }),
+        ("get_cached", get_cached, { "cold": lambda: (invalidate(), drop_cache()), "warm": None }),
+        ("vs", backend("vs"), { "cold": lambda: (invalidate(), clean()), "warm": None }),
+        ("make", backend("make"), { "cold": lambda: (invalidate(), clean()), "warm": None }),
+        ("ninja", backend("ninja"), { "cold": lambda: (invalidate(), clean()), "warm": None }),
+        ("plan", plan, { "cold": invalidate, "warm": None })
+        ]
+
+
+def measure(func, ws, setup, repeat):
+    def prepare():
+        if setup:
+            setup()
+        else:
+            func(ws) # warm up
+
+    best = None
+    for i in range(repeat):
+        prepare()
+        beg = time.perf_counter()
+        func(ws)
+        elapsed = time.perf_counter() - beg
+        best = elapsed if best is None else min(best, elapsed)
+
+    # tracemalloc slows everything down, memory is measured in a separate run
+    prepare()
+    tracemalloc.start()
+    func(ws)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def commit():
+    res = subprocess.run([ "git", "rev-parse", "HEAD" ], cwd=Path(__file__).parent, capture_output=True, text=True)
+    return res.stdout.strip() if res.returncode == 0 else None
+
+
+def compare(results, path):
+    base = { (r["shape"], r["bench"], r["state"]): r for r in json.loads(Path(path).read_text())["results"] }
+    print("\nshape\tbench\tstate\ttime\tmemory")
+    for r in results:
+        b = base.get((r["shape"], r["bench"], r["state"]))
+        if not b:
+            continue
+        print(f"{r['shape']}\t{r['bench']}\t{r['state']}\t{r['seconds'] / max(b['seconds'], 1e-9):.2f}x\t{r['peak_bytes'] / max(b['peak_bytes'], 1):.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="jmake generation benchmarks")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies project and file counts")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs, the fastest is reported")
+    parser.add_argument("--shape", action="append", choices=list(shapes.keys()))
+    parser.add_argument("--bench", action="append", choices=[ b[0] for b in benches ])
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="print ratios against the results in this file")
+    args = parser.parse_args()
+
+    host = jmake.Env()
+    host.vs = "vs22"
+    results = []
+    print("shape\tbench\tstate\tseconds\tpeak MiB")
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        host.paths.append(Path(tmp))
+        try:
+            for shape in args.shape or shapes.keys():
+                ws = shapes[shape](args.scale)
+                ws.graph()
+                clean()
+                for name, func, states in benches:
+                    if args.bench and name not in args.bench:
+                        continue
+                    for state, setup in states.items():
+                        # generators print build instructions
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            seconds, peak = measure(func, ws, setup, args.repeat)
+                        results.append({ "shape": shape, "bench": name, "state": state, "seconds": seconds, "peak_bytes": peak })
+                        print(f"{shape}\t{name}\t{state}\t{seconds:.4f}\t{peak / (1 << 20):.1f}")
+        finally:
+            os.chdir(cwd)
+
+    if args.json:
+        data = {
+                "version": VERSION,
+                "commit": commit(),
+                "python": sys.version.split()[0],
+                "machine": platform.machine(),
+                "scale": args.scale,
+                "results": results
+                }
+        Path(args.json).write_text(json.dumps(data, indent=1) + "\n")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# times VSGenerator.vcxproj for growing file counts, the time per file should stay flat
+import tempfile
+import time
+import sys
+from pathlib import Path
+
+import jmake
+from jmake import generator
+
+
+def workspace(count):
+    ws = jmake.Workspace("bench")
+    project = jmake.Project("bench", target=jmake.Target.STATIC_LIBRARY)
+    project.add([ f"src/dir{i // 100}/file{i}.cpp" for i in range(count) ])
+    project.include([ "include", "src" ])
+    project.define("BENCH", True)
+    ws.add(project)
+    return ws
+
+
+def run(count):
+    ws = workspace(count)
+    project = ws["bench"]
+    gen = generator.VSGenerator()
+    gen._workspace = ws
+    gen._uuid = { "bench": "00000000-0000-0000-0000-000000000000" }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        beg = time.perf_counter()
+        with open(Path(tmp) / "bench.vcxproj", 'w') as f:
+            gen.vcxproj(project, f)
+        return time.perf_counter() - beg
+
+
+def main():
+    host = jmake.Env()
+    host.vs = "vs22"
+    host.paths.append(Path.cwd())
+
+    counts = [ int(arg) for arg in sys.argv[1:] ] or [ 2000, 4000, 8000, 16000, 32000, 64000 ]
+    base = None
+    print("files\tseconds\tus/file\tratio")
+    for count in counts:
+        elapsed = min([ run(count) for i in range(3) ])
+        per = elapsed / count
+        base = base or per
+        print(f"{count}\t{elapsed:.4f}\t{per * 1e6:.2f}\t{per / base:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,12 @@ from .jmake import Platform
 from .jmake import prebuild
 from .jmake import postbuild
 from .jmake import Env
+from .jmake import DependencyCycle
 
 from .utils import glob
 from .utils import package
+from .utils import declare_package
+from .utils import resolve_packages
 from .utils import generate
 from .utils import fullpath
 from .utils import rootpath
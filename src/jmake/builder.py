@@ -0,0 +1,422 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+import contextlib
+import subprocess
+import threading
+import time
+import os
+
+from . import jmake
+from . import toolchain
+from . import objcache
+from . import depindex
+from . import unity
+from . import modscan
+from . import trace
+from . import worker
+from . import history
+
+
+# returns tuple(code, output, peak resident memory of the command in bytes or None)
+def execute(command):
+    if not hasattr(os, "wait4"):
+        res = subprocess.run(command, capture_output=True, text=True)
+        return (res.returncode, res.stdout + res.stderr, None)
+    # reap the child ourselves, its rusage carries the peak memory of the compiler processes it waited for
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    with proc.stdout:
+        out = proc.stdout.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return (proc.returncode, out, usage.ru_maxrss * 1024)
+
+
+# longest time from the start of each action to the end of the build following its dependents, weight maps an
+# action to its duration, only edges between the given actions count
+def critical_path(actions, weight):
+    members = set(actions)
+    pending = { action: len([ dep for dep in action.deps if dep in members ]) for action in actions }
+    order = [ action for action in actions if pending[action] == 0 ]
+    for action in order:
+        for dependent in action.dependents:
+            if dependent in members:
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    order.append(dependent)
+    path = {}
+    for action in reversed(order):
+        path[action] = weight(action) + max([ path[dep] for dep in action.dependents if dep in members ] + [ 0 ])
+    return path
+
+
+class Action:
+    def __init__(self, kind, project, description, outputs=[], inputs=[], command=None, func=None):
+        self.kind = kind
+        self.pool = kind
+        self.memory = 0 # expected peak memory in bytes, history overrides it
+        self.peak = None # measured peak memory of the last run
+        self.local = None # semaphore capping the processes builds run on this machine
+        self.elapsed = None # wall time of the run in seconds
+        self.project = project
+        self.description = description
+        self.outputs = outputs
+        self.inputs = inputs
+        self.command = command
+        self.func = func
+        self.deps = []
+        self.dependents = []
+        self.trigger = None # hooks with a trigger only run if it ran
+        self.ran = False
+
+    def depend(self, action):
+        if action is None:
+            return
+        self.deps.append(action)
+        action.dependents.append(self)
+
+    # an action is stale when an output is missing or older than any of its inputs
+    def stale(self):
+        if self.func:
+            return self.trigger is None or self.trigger.ran
+        if not all([ output.exists() for output in self.outputs ]):
+            return True
+        oldest = min([ output.stat().st_mtime_ns for output in self.outputs ])
+        for fname in self.inputs:
+            p = Path(fname)
+            if not p.exists() or p.stat().st_mtime_ns > oldest:
+                return True
+        return False
+
+    def run(self):
+        if self.func:
+            self.func()
+            return (0, "")
+        # never leave a stale output behind, archives are also updated in place otherwise
+        for output in self.outputs:
+            output.parent.mkdir(parents=True, exist_ok=True)
+            output.unlink(missing_ok=True)
+        with self.local or contextlib.nullcontext():
+            code, out, self.peak = execute(self.command)
+        return (code, out)
+
+    def key(self):
+        return str(self.outputs[0]) if len(self.outputs) else self.description
+
+
+class CompileAction(Action):
+    def __init__(self, project, description, obj, src, tool, flags, cache=None, index=None, remote=None, cxx=True):
+        command = [ tool ] + flags + [ "-MMD", "-MF", str(obj) + ".d", "-c", "-o", str(obj), src ]
+        super().__init__("compile", project, description, outputs=[ obj ], inputs=[ src ], command=command)
+        self.tool = tool
+        self.flags = flags
+        self.cache = cache
+        self.index = index
+        self.remote = remote
+        self.cxx = cxx
+
+    # the header index knows every file the object was built from
+    def stale(self):
+        if self.index is None:
+            return super().stale()
+        return self.index.stale(self.outputs[0]) or super().stale()
+
+    def run(self):
+        code, out = self._compile()
+        if code == 0 and self.index is not None:
+            self.index.update(self.outputs[0])
+        return (code, out)
+
+    # the preprocessor also writes the depfile so it stays valid on a cache hit or a remote compile
+    def _compile(self):
+        if self.cache is None and self.remote is None:
+            return super().run()
+        obj = self.outputs[0]
+        obj.parent.mkdir(parents=True, exist_ok=True)
+        obj.unlink(missing_ok=True)
+        src = self.inputs[0]
+        cmd = [ self.tool ] + self.flags + [ "-E", "-MMD", "-MF", str(obj) + ".d", "-MT", str(obj), src ]
+        with self.local or contextlib.nullcontext():
+            res = subprocess.run(cmd, capture_output=True)
+        if res.returncode != 0:
+            return super().run()
+
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self.tool, self.flags, res.stdout)
+            text = self.cache.fetch(key, obj)
+            if text is not None:
+                return (0, text)
+
+        result = None
+        if self.remote is not None:
+            result = self.remote.compile(self.tool, self.flags, res.stdout, src, self.cxx, obj)
+        code, out = result if result is not None else super().run()
+        if code == 0 and key is not None:
+            self.cache.store(key, obj, out)
+        return (code, out)
+
+
+class Builder:
+    def __init__(self, workspace, config, jobs=None):
+        host = jmake.Env()
+        self._workspace = workspace
+        self._config = config
+        self._jobs = jobs if jobs else (host.vcpu or 1)
+        self._fixed = bool(jobs)
+        # worker jobs only add threads waiting on the network, units falling back to local compiles queue here
+        self._local = threading.Semaphore(self._jobs)
+        self._toolchain = toolchain.GCCToolchain(workspace)
+        self._tools = {
+                "cc": os.environ.get("CC", "cc"),
+                "cxx": os.environ.get("CXX", "c++"),
+                "ar": os.environ.get("AR", "ar")
+                }
+        self._hooklock = threading.Lock()
+        self._cache = objcache.ObjectCache() if host.cache_size else None
+        # remote workers add their jobs on top of the local ones, links always run locally
+        self._remote = worker.WorkerPool.create()
+        self._index = depindex.DepIndex()
+        self._history = history.ActionHistory()
+        self._pools = host.pools
+        self._links = {}
+        self._outputs = {}
+        self._units = {}
+        self._scanner = modscan.ModuleScanner()
+        self.actions = []
+
+    # jobs of dropped workers stop counting
+    def jobs(self):
+        if self._remote and not self._fixed:
+            return self._jobs + self._remote.slots()
+        return self._jobs
+
+    def _add(self, action):
+        action.local = self._local
+        self.actions.append(action)
+        return action
+
+    def _hook(self, project, event):
+        config = self._config
+        def func():
+            with self._hooklock:
+                print(f"running {event} events...")
+                getattr(project, event)(config)
+                self._index.forget()
+        return Action("hook", project, f"{event.upper()} {project._name}", func=func)
+
+    def _compile(self, opt, action):
+        action.pool = opt["compile_pool"]
+        action.memory = opt["compile_memory"] << 20
+        return self._add(action)
+
+    def plan(self, projects=None):
+        graph = self._workspace.graph()
+        if projects is None:
+            projects = graph
+        with trace.span("plan"):
+            for project in projects:
+                if jmake.valid_dependency_project(project):
+                    self._plan(project)
+        return self.actions
+
+    def _plan(self, project):
+        if project._name in self._links:
+            return self._links[project._name]
+
+        for dependency in project._dependencies:
+            if jmake.valid_dependency_project(dependency):
+                self._plan(dependency)
+
+        tc = self._toolchain
+        config = self._config
+        opt = project.options(self._workspace._configs)[config]
+
+        prebuild = None
+        if tc.has_hooks(project, config, "prebuild"):
+            prebuild = self._add(self._hook(project, "prebuild"))
+
+        unity.write(tc.unity(project))
+        tc.write_pch(project)
+        pch = tc.pch(project, opt, config)
+        gch = None
+        if pch:
+            # a .gch only loads into the exact compiler that wrote it, so it is never cached
+            out = Path(f"{pch}.gch")
+            gch = self._compile(opt, CompileAction(project, f"PCH {out}", out, str(pch), self._tools["cxx"], tc.pch_flags(project, opt), None, self._index))
+            gch.depend(prebuild)
+
+        # units only wait for the module interfaces they import, independent interfaces compile in parallel
+        deps = tc.module_deps(project, opt, self._scanner)
+        objects = []
+        compiles = []
+        for fname, module in tc.units(project):
+            providers, imports = deps[fname]
+            src = str(Path(fname).absolute())
+            obj = tc.object(project, config, fname)
+            cxx = tc.is_cxx(fname, module)
+            tool = self._tools["cxx" if cxx else "cc"]
+            flags = tc.compile_flags(project, opt, fname, module or imports, pch)
+            # module units produce bmi files as a side effect so they bypass the cache and workers, importers read them
+            cache = None if module or imports else self._cache
+            remote = None if module or imports else self._remote
+            action = self._compile(opt, CompileAction(project, f"{'CXX' if cxx else 'CC'} {obj}", obj, src, tool, flags, cache, self._index, remote, cxx))
+            action.depend(prebuild)
+            if gch and cxx and not module and not imports:
+                action.depend(gch)
+                action.inputs.append(gch.outputs[0])
+            self._units[(project._name, fname)] = action
+            objects.append(obj)
+            compiles.append(action)
+
+        # providers inside the project may come later in the unit list
+        for fname, module in tc.units(project):
+            action = self._units[(project._name, fname)]
+            for dep, provider in deps[fname][0]:
+                bmi = self._units[(dep._name, provider)]
+                action.depend(bmi)
+                action.inputs.append(bmi.outputs[0])
+
+        output = tc.output(project, config)
+        if project._target == jmake.Target.STATIC_LIBRARY:
+            command = [ self._tools["ar"], "rcs", str(output) ]
+            command.extend([ str(obj) for obj in objects ])
+            inputs = objects
+            description = f"AR {output}"
+        else:
+            inputs = objects + tc.link_inputs(project, opt, config)
+            command = [ self._tools[tc.linker(project)], "-o", str(output) ]
+            command.extend([ str(obj) for obj in objects ])
+            command.extend(tc.link_flags(project, opt, config))
+            description = f"LINK {output}"
+
+        link = self._add(Action("link", project, description, outputs=[ output ], inputs=inputs, command=command))
+        link.pool = opt["link_pool"]
+        link.memory = opt["link_memory"] << 20
+        for action in compiles:
+            link.depend(action)
+        if project._target != jmake.Target.STATIC_LIBRARY:
+            for path in tc.link_inputs(project, opt, config):
+                link.depend(self._outputs.get(path))
+        self._links[project._name] = link
+        self._outputs[output] = link
+
+        if tc.has_hooks(project, config, "postbuild"):
+            postbuild = self._add(self._hook(project, "postbuild"))
+            postbuild.depend(link)
+            postbuild.trigger = link
+        return link
+
+    # returns true if every action succeeded, dependents of an action run as soon as it finishes
+    # ready actions start longest remaining critical path first, durations come from previous builds
+    # an action only starts while its job pool has room and the memory it is expected to need is not reserved by
+    # running actions, the first action always starts so a build never stalls
+    def run(self):
+        pending = { action: len(action.deps) for action in self.actions }
+        ready = [ action for action in self.actions if pending[action] == 0 ]
+        failed = []
+        running = {}
+        ran = []
+        count = 0
+        start = time.perf_counter()
+
+        means = { kind: self._history.mean(kind, "time") for kind in [ "compile", "link", "hook" ] }
+        estimates = { action: self._history.get(action.key()).get("time") or means.get(action.kind) or 1.0 for action in self.actions }
+        priority = critical_path(self.actions, lambda action: estimates[action])
+
+        active = {}
+        budget = history.available_memory()
+        memory = { kind: self._history.mean(kind, "memory") for kind in [ "compile", "link" ] }
+        reserved = {}
+
+        def estimate(action):
+            return self._history.get(action.key()).get("memory") or action.memory or memory.get(action.kind) or 0
+
+        def admit(action):
+            limit = self._pools.get(action.pool)
+            if limit and active.get(action.pool, 0) >= limit:
+                return False
+            if budget is None or not len(running):
+                return True
+            return sum(reserved.values()) + estimate(action) <= budget
+
+        def run(action):
+            with trace.span(action.description, cat=action.kind, args={ "project": action.project._name, "pool": action.pool }):
+                beg = time.perf_counter()
+                try:
+                    return action.run()
+                finally:
+                    action.elapsed = time.perf_counter() - beg
+
+        def finish(action):
+            for dependent in action.dependents:
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    ready.append(dependent)
+
+        with ThreadPoolExecutor(max_workers=self.jobs()) as pool:
+            while len(ready) or len(running):
+                ready.sort(key=lambda action: -priority[action])
+                i = 0
+                while i < len(ready) and len(running) < self.jobs() and not len(failed):
+                    action = ready[i]
+                    if not action.stale():
+                        ready.pop(i)
+                        finish(action)
+                        continue
+                    if not admit(action):
+                        i += 1
+                        continue
+                    ready.pop(i)
+                    active[action.pool] = active.get(action.pool, 0) + 1
+                    reserved[action] = estimate(action)
+                    running[pool.submit(run, action)] = action
+
+                if not len(running):
+                    break
+
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    action = running.pop(future)
+                    active[action.pool] -= 1
+                    del reserved[action]
+                    try:
+                        code, out = future.result()
+                    except Exception as e:
+                        code, out = (1, f"{e}\n")
+                    self._history.record(action.key(), action.kind, memory=action.peak, time=round(action.elapsed, 3))
+                    ran.append(action)
+                    count += 1
+                    print(f"[{count}] {action.description}")
+                    if out:
+                        print(out, end='')
+                    if code != 0:
+                        print(f"failed: {action.description}")
+                        failed.append(action)
+                        continue
+                    action.ran = True
+                    finish(action)
+
+        self._index.save()
+        self._scanner.save()
+        self._history.save()
+        if self._cache:
+            self._cache.evict()
+            self._cache.save()
+            stats = self._cache.stats
+            print(f"object cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evicted")
+        if self._remote:
+            stats = self._remote.stats
+            print(f"workers: {stats['remote']} remote compiles, {stats['failures']} workers failed")
+
+        if len(ran):
+            wall = time.perf_counter() - start
+            work = sum([ action.elapsed for action in ran ])
+            estimated = max(critical_path(ran, lambda action: estimates[action]).values())
+            measured = max(critical_path(ran, lambda action: action.elapsed).values())
+            print(f"critical path {measured:.2f}s (estimated {estimated:.2f}s), {work:.2f}s of work in {wall:.2f}s, parallelism {work / max(wall, 1e-9):.1f}x of {self.jobs()}")
+
+        if len(failed):
+            print(f"build stopped, {len(failed)} action(s) failed")
+        elif count == 0:
+            print("no work to do")
+        return not len(failed)
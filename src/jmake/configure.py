@@ -0,0 +1,213 @@
+from pathlib import Path
+from hashlib import md5
+import time
+import json
+import os
+import re
+
+from . import jmake
+from . import output
+
+_pattern = re.compile(r'@(\w+)@')
+
+
+def stamp(path, exact=False):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    # a template changed within the timestamp granularity may change again unnoticed, never trust its stamp
+    if not exact and time.time_ns() - st.st_mtime_ns < 2_000_000_000:
+        return None
+    return [ st.st_mtime_ns, st.st_size ]
+
+
+# a plan is a list of literal strings and substitutions, lines are numbered from 1
+# [ "var", name, line, text ] substitutes @name@
+# [ "define", name, ending ] is a #cmakedefine, empty if name is not set
+# [ "error", line, text ] is a #cmakedefine without a variable name
+def compile_template(text):
+    plan = []
+    def literal(s):
+        if not s:
+            return
+        if len(plan) and type(plan[-1]) == str:
+            plan[-1] += s
+        else:
+            plan.append(s)
+
+    for i, line in enumerate(text.splitlines(keepends=True)):
+        if not '#cmakedefine' in line:
+            parts = _pattern.split(line)
+            for j, part in enumerate(parts):
+                if j % 2 == 0:
+                    literal(part)
+                else:
+                    plan.append([ "var", part, i + 1, line ])
+            continue
+
+        body = line.rstrip("\r\n")
+        tokens = [ token for token in body.expandtabs(1).split(' ') if token != '' and not '#cmakedefine' in token ]
+        if not len(tokens):
+            plan.append([ "error", i + 1, line ])
+            literal(line)
+            continue
+        plan.append([ "define", tokens[0], line[len(body):] ])
+    return plan
+
+
+# returns tuple(text, warnings)
+def apply(plan, opts):
+    res = []
+    warnings = []
+    for step in plan:
+        if type(step) == str:
+            res.append(step)
+        elif step[0] == "var":
+            if step[1] not in opts:
+                warnings.append(f"possible error on line {step[2]}, {step[1]} not found in opts\n{step[3]}")
+                res.append(f"@{step[1]}@")
+                continue
+            res.append(opts[step[1]])
+        elif step[0] == "define":
+            if step[1] in opts:
+                res.append(f"#define {step[1]} {opts[step[1]]}{step[2]}")
+        else:
+            warnings.append(f"possible error on line {step[1]}, variable name not found\n{step[2]}")
+    return (''.join(res), warnings)
+
+
+# configure_file outputs are written as soon as they are added so the rest of the script can read them, templates
+# compile to plans cached by content hash and outputs are skipped while the template, the options and the output
+# itself are unchanged, run() configures replayed outputs and forgets the ones no longer added
+class Configure:
+    VERSION = 2
+
+    def __init__(self, path=None):
+        self._path = path
+        self._state = None
+        self._queue = [] # replayed outputs waiting for run()
+        self._configured = [] # tuple(fname_in, fname_out) of every output configured in this run
+        self._replay = False
+        self._changed = False
+
+    def path(self):
+        if self._path is None:
+            host = jmake.Env()
+            return Path(host.bin).absolute() / "jmake" / "configure.json"
+        return Path(self._path)
+
+    def _load(self):
+        if self._state is not None:
+            return
+        self._state = { "templates": {}, "plans": {}, "outputs": {} }
+        p = self.path()
+        if not p.is_file():
+            return
+        try:
+            data = json.loads(p.read_text())
+        except json.JSONDecodeError:
+            return
+        if data.get("version") == self.VERSION:
+            self._state = data["state"]
+
+    def add(self, fname_in, fname_out, opts):
+        self._load()
+        opts = { str(key): str(value) for key, value in opts.items() }
+        self._configure(str(Path(fname_in).absolute()), str(Path(fname_out).absolute()), opts)
+
+    # queue every output configured by an earlier run, used when the build script was not evaluated
+    def replay(self, templates=None):
+        self._load()
+        self._replay = True
+        for fname_out, entry in self._state["outputs"].items():
+            if templates is None or entry["template"] in templates:
+                self._queue.append((entry["template"], fname_out, entry["values"]))
+
+    # configure the outputs of the given templates again, a later run() prunes outputs again
+    def rerun(self, templates):
+        self.replay(templates)
+        try:
+            self.run()
+        finally:
+            self._replay = False
+
+    def templates(self):
+        self._load()
+        return list(self._state["templates"].keys())
+
+    def _template(self, fname):
+        templates = self._state["templates"]
+        st = stamp(fname)
+        entry = templates.get(fname)
+        if st is not None and entry and entry["stamp"] == st and entry["hash"] in self._state["plans"]:
+            return entry["hash"]
+
+        with open(fname) as f:
+            text = f.read()
+        h = md5(bytes(text, 'utf-8')).hexdigest()
+        if h not in self._state["plans"]:
+            self._state["plans"][h] = compile_template(text)
+        templates[fname] = { "stamp": st, "hash": h }
+        self._changed = True
+        return h
+
+    def _configure(self, fname_in, fname_out, opts):
+        output.manifest.record(fname_out)
+        self._configured.append((fname_in, fname_out))
+        outputs = self._state["outputs"]
+        h = self._template(fname_in)
+        values = md5(bytes(json.dumps(opts, sort_keys=True), 'utf-8')).hexdigest()
+        entry = outputs.get(fname_out)
+        if entry and entry["hash"] == h and entry["opts"] == values and entry["stamp"] == stamp(fname_out, True) \
+                and entry["stamp"] is not None:
+            # the warnings of a skipped output are still reported
+            print(''.join(entry["warnings"]), end='')
+            return
+
+        data, warnings = apply(self._state["plans"][h], opts)
+        print(''.join(warnings), end='')
+        if output.write(fname_out, data):
+            print(f"configured {fname_in}, wrote {len(data)} bytes to {fname_out}")
+        outputs[fname_out] = { "template": fname_in, "hash": h, "opts": values, "values": opts, "stamp": stamp(fname_out, True),
+                "warnings": warnings }
+        self._changed = True
+
+    def run(self):
+        if not len(self._queue) and not len(self._configured) and not self.path().is_file():
+            return
+        self._load()
+        queue, self._queue = self._queue, []
+        for fname_in, fname_out, opts in queue:
+            self._configure(fname_in, fname_out, opts)
+
+        # outputs no longer configured by the build script are forgotten
+        outputs = self._state["outputs"]
+        if not self._replay:
+            configured = { fname_out for _, fname_out in self._configured }
+            for fname_out in list(outputs.keys()):
+                if fname_out not in configured:
+                    del outputs[fname_out]
+                    self._changed = True
+            templates = { fname_in for fname_in, _ in self._configured }
+            for fname_in in list(self._state["templates"].keys()):
+                if fname_in not in templates:
+                    del self._state["templates"][fname_in]
+                    self._changed = True
+        self._configured = []
+
+        used = { entry["hash"] for entry in self._state["templates"].values() }
+        for h in list(self._state["plans"].keys()):
+            if h not in used:
+                del self._state["plans"][h]
+        self.save()
+
+    def save(self):
+        if not self._changed or self._state is None:
+            return
+        p = self.path()
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_suffix(f".{os.getpid()}")
+        tmp.write_text(json.dumps({ "version": self.VERSION, "state": self._state }))
+        os.replace(tmp, p)
+        self._changed = False
@@ -0,0 +1,144 @@
+from pathlib import Path
+import threading
+import json
+import os
+
+from . import jmake
+
+
+# parse a gcc style depfile, returns the prerequisites of its single rule
+def parse_depfile(path):
+    try:
+        data = Path(path).read_text()
+    except FileNotFoundError:
+        return None
+
+    data = data.replace("\\\r\n", " ").replace("\\\n", " ")
+    _, sep, prereqs = data.partition(": ")
+    if not sep:
+        return []
+    # only the first rule lists the sources, gcc adds rules for the modules a unit provides and imports
+    prereqs = prereqs.partition("\n")[0]
+
+    deps = []
+    token = ""
+    i = 0
+    while i < len(prereqs):
+        c = prereqs[i]
+        if c == "\\" and i + 1 < len(prereqs) and prereqs[i + 1] in " #":
+            token += prereqs[i + 1]
+            i += 2
+            continue
+        if c.isspace():
+            if token:
+                deps.append(token)
+            token = ""
+        else:
+            token += c
+        i += 1
+    if token:
+        deps.append(token)
+    return deps
+
+
+# persistent object -> header map merged from the depfiles of every compile, stored next to cache.jml
+class DepIndex:
+    VERSION = 1
+
+    def __init__(self, path=None):
+        host = jmake.Env()
+        self._path = Path(path) if path else Path(host.bin).absolute() / "jmake" / "depindex.json"
+        self._lock = threading.Lock()
+        self._objects = None
+        self._mtimes = {}
+        self._changed = False
+
+    def _load(self):
+        if self._objects is not None:
+            return
+        self._objects = {}
+        if not self._path.is_file():
+            return
+        try:
+            data = json.loads(self._path.read_text())
+        except json.JSONDecodeError:
+            return
+        if data.get("version") != self.VERSION:
+            return
+        headers = data["headers"]
+        self._objects = { obj: [ headers[i] for i in deps ] for obj, deps in data["objects"].items() }
+
+    def mtime(self, path):
+        path = str(path)
+        if path not in self._mtimes:
+            try:
+                self._mtimes[path] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                self._mtimes[path] = None
+        return self._mtimes[path]
+
+    # drop cached timestamps, hooks may have touched headers
+    def forget(self):
+        with self._lock:
+            self._mtimes = {}
+
+    def dependencies(self, obj):
+        with self._lock:
+            self._load()
+            obj = str(obj)
+            if obj not in self._objects:
+                deps = parse_depfile(obj + ".d")
+                if deps is None:
+                    return None
+                self._objects[obj] = deps
+                self._changed = True
+            return self._objects[obj]
+
+    # merge the depfile written by the last compile of obj
+    def update(self, obj):
+        deps = parse_depfile(str(obj) + ".d")
+        with self._lock:
+            self._load()
+            obj = str(obj)
+            if deps is None:
+                self._objects.pop(obj, None)
+            else:
+                self._objects[obj] = deps
+            for dep in deps or []:
+                self._mtimes.pop(dep, None)
+            self._changed = True
+
+    # true if obj is missing, unknown to the index or older than anything it was built from
+    def stale(self, obj):
+        oldest = self.mtime(obj)
+        if oldest is None:
+            return True
+        deps = self.dependencies(obj)
+        if deps is None:
+            return True
+        for dep in deps:
+            mtime = self.mtime(dep)
+            if mtime is None or mtime > oldest:
+                return True
+        return False
+
+    def save(self):
+        with self._lock:
+            if not self._changed:
+                return
+            headers = []
+            ids = {}
+            objects = {}
+            for obj, deps in self._objects.items():
+                refs = []
+                for dep in deps:
+                    if dep not in ids:
+                        ids[dep] = len(headers)
+                        headers.append(dep)
+                    refs.append(ids[dep])
+                objects[obj] = refs
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self._path.with_suffix(f".{os.getpid()}")
+            tmp.write_text(json.dumps({ "version": self.VERSION, "headers": headers, "objects": objects }))
+            os.replace(tmp, self._path)
+            self._changed = False
@@ -0,0 +1,212 @@
+from pathlib import Path
+import functools
+import time
+import json
+import os
+import re
+
+from . import jmake
+
+
+def split(pattern):
+    return [ part for part in pattern.replace("\\", "/").split("/") if part not in [ "", "." ] ]
+
+
+def wildcard(part):
+    return part == "**" or any([ c in part for c in "*?[" ])
+
+
+# returns tuple(root, pattern) where root is the deepest directory every match is below, the literal leading
+# directories of the pattern including ".." segments are folded into it
+def rebase(base, pattern):
+    parts = split(pattern)
+    i = 0
+    while i < len(parts) - 1 and not wildcard(parts[i]):
+        i += 1
+    trailing = "/" if pattern.replace("\\", "/").endswith("/") else ""
+    return (Path(os.path.normpath(Path(base, *parts[:i]))), "/".join(parts[i:]) + trailing)
+
+
+# translate a glob pattern relative to the search directory into a regex, "**" matches any number of directories
+# exclude patterns and single path components are matched with it
+@functools.lru_cache(maxsize=None)
+def translate(pattern):
+    parts = split(pattern)
+    res = ""
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        if part == "**" and not last:
+            res += "(?:[^/]+/)*"
+            continue
+        if part == "**":
+            res = res[:-1] + "(?:/[^/]+)*" if res else "(?:[^/]+(?:/[^/]+)*)?"
+            continue
+        j = 0
+        while j < len(part):
+            c = part[j]
+            if c == "*":
+                res += "[^/]*"
+            elif c == "?":
+                res += "[^/]"
+            elif c == "[":
+                end = part.find("]", j + 1)
+                if end < 0:
+                    res += "\\["
+                else:
+                    chars = part[j + 1:end]
+                    if chars.startswith("!"):
+                        chars = "^" + chars[1:]
+                    res += "[" + chars.replace("\\", "\\\\").replace("[", "\\[") + "]"
+                    j = end
+            else:
+                res += re.escape(c)
+            j += 1
+        if not last:
+            res += "/"
+    return re.compile(res + "$")
+
+
+def depth(pattern):
+    parts = split(pattern)
+    return None if "**" in parts else len(parts)
+
+
+# like pathlib a trailing "/" or "**" only matches directories
+def dironly(pattern):
+    pattern = pattern.replace("\\", "/")
+    return pattern.endswith("/") or pattern.rstrip("/").endswith("**")
+
+
+# directory listings keyed on directory mtime, persisted so unchanged trees are only stat'ed
+class DirIndex:
+    VERSION = 2
+
+    def __init__(self, path=None):
+        self._path = path
+        self._dirs = None
+        self._checked = set()
+        self._changed = False
+
+    def path(self):
+        if self._path is None:
+            host = jmake.Env()
+            return Path(host.bin).absolute() / "jmake" / "dirindex.json"
+        return Path(self._path)
+
+    def _load(self):
+        if self._dirs is not None:
+            return
+        self._dirs = {}
+        p = self.path()
+        if not p.is_file():
+            return
+        try:
+            data = json.loads(p.read_text())
+        except json.JSONDecodeError:
+            return
+        if data.get("version") == self.VERSION:
+            self._dirs = data["dirs"]
+
+    # returns tuple(files, dirs, links) of sorted names, links are symlinks to directories, every directory is scanned
+    # at most once per run
+    def listdir(self, path):
+        self._load()
+        key = str(path)
+        if key in self._checked:
+            entry = self._dirs.get(key)
+            return (entry[1], entry[2], entry[3]) if entry else ([], [], [])
+
+        self._checked.add(key)
+        try:
+            mtime = os.stat(key).st_mtime_ns
+        except OSError:
+            if self._dirs.pop(key, None):
+                self._changed = True
+            return ([], [], [])
+
+        entry = self._dirs.get(key)
+        if entry is None or entry[0] != mtime:
+            files = []
+            dirs = []
+            links = []
+            with os.scandir(key) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        dirs.append(e.name)
+                    elif e.is_dir():
+                        links.append(e.name)
+                    else:
+                        files.append(e.name)
+            # a directory changed within the timestamp granularity may change again unnoticed, rescan it next time
+            recent = time.time_ns() - mtime < 2_000_000_000
+            entry = [ -1 if recent else mtime, sorted(files), sorted(dirs), sorted(links) ]
+            self._dirs[key] = entry
+            self._changed = True
+        return (entry[1], entry[2], entry[3])
+
+    # directories listed in this run
+    def checked(self):
+        return list(self._checked)
+
+    # list of tuple(relpath: str, isdir: bool) of base and everything below it, up to maxdepth levels, symlinked
+    # directories are neither listed nor entered
+    def walk(self, base, maxdepth=None):
+        res = [ ("", True) ]
+        stack = [ (Path(base), "", 1) ]
+        while len(stack):
+            path, rel, level = stack.pop()
+            files, dirs, links = self.listdir(path)
+            res.extend([ (rel + name, False) for name in files ])
+            for name in dirs:
+                res.append((rel + name, True))
+                if maxdepth is None or level < maxdepth:
+                    stack.append((path / name, rel + name + "/", level + 1))
+        return res
+
+    # adds the paths relative to path matching parts to res, like pathlib "**" only walks real directories while
+    # the other components also follow symlinked ones, literal components are joined without listing so ".." works
+    def _select(self, path, rel, parts, dirs, res):
+        if not len(parts):
+            res.add(rel)
+            return
+        part = parts[0]
+        last = len(parts) == 1
+        if part == "**":
+            stack = [ (path, rel) ]
+            while len(stack):
+                p, r = stack.pop()
+                self._select(p, r, parts[1:], dirs, res)
+                stack.extend([ (p / name, f"{r}/{name}" if r else name) for name in self.listdir(p)[1] ])
+            return
+        files, subdirs, links = self.listdir(path)
+        if part == "..":
+            names = [ part ]
+        elif not wildcard(part):
+            names = [ part ] if part in subdirs or part in links or (last and not dirs and part in files) else []
+        else:
+            regex = translate(part)
+            names = [ name for name in (subdirs + links if dirs or not last else files + subdirs + links) if regex.match(name) ]
+        for name in names:
+            if last:
+                res.add(f"{rel}/{name}" if rel else name)
+            else:
+                self._select(path / name, f"{rel}/{name}" if rel else name, parts[1:], dirs, res)
+
+    # paths are built like pathlib builds them, ".." segments stay in them, excludes match the path relative to base
+    def glob(self, base, patterns, exclude=[]):
+        exclude = [ translate(pattern) for pattern in exclude ]
+        found = set()
+        for pattern in patterns:
+            self._select(Path(base), "", split(pattern), dironly(pattern), found)
+        res = [ str(Path(base, rel).absolute()) for rel in found if not any([ p.match(rel) for p in exclude ]) ]
+        return sorted(res)
+
+    def save(self):
+        if not self._changed or self._dirs is None:
+            return
+        p = self.path()
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_suffix(f".{os.getpid()}")
+        tmp.write_text(json.dumps({ "version": self.VERSION, "dirs": self._dirs }))
+        os.replace(tmp, p)
+        self._changed = False
@@ -1,28 +1,131 @@
 from pathlib import Path
 from uuid import uuid4
-from hashlib import file_digest
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import hashlib
+import subprocess
+import shlex
+import json
+import sys
+import os
+import re
 
 from . import jmake
+from . import toolchain
+from . import output
+from . import hookserver
+from . import unity
+from . import modscan
+from . import trace
 import jmllib
 
 
+_emitting = None # tuple(generator, projects by name) inherited by forked render processes
+
+
+def _render(name):
+    gen, projects = _emitting
+    return gen.render(projects[name])
+
+
 class Generator:
+    jobs = None # processes rendering project files, defaults to Env.vcpu
+    force = True # emit the projects added to the workspace even if their fingerprint did not change
+
     def generate(self, workspace):
         pass
 
+    def render(self, project):
+        pass
+
+    # prepare(project) runs here and returns the path of a project file to render or None, rendering is cpu bound python
+    # so it runs in forked processes that inherit the evaluated workspace, they get a project name and only send back
+    # the text, every file is written here so the output matches a serial run
+    def emit(self, workspace, projects, prepare):
+        global _emitting
+        todo = []
+        for project in projects:
+            project.options(workspace._configs) # resolved before forking, children inherit the cache
+            path = prepare(project)
+            if path is not None:
+                todo.append((project, path))
 
-def get_cached(projects):
+        host = jmake.Env()
+        jobs = min(self.jobs or host.vcpu or 1, len(todo))
+        if jobs <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            for project, path in todo:
+                with trace.span("emit " + project._name, cat="emit"):
+                    output.write(path, self.render(project))
+            return
+
+        _emitting = (self, { project._name: project for project, path in todo })
+        try:
+            with trace.span(f"emit {len(todo)} projects", cat="emit", args={ "processes": jobs }):
+                with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("fork")) as pool:
+                    texts = pool.map(_render, [ project._name for project, path in todo ])
+                    for (project, path), text in zip(todo, texts):
+                        output.write(path, text)
+        finally:
+            _emitting = None
+
+    # module imports live in the sources, a project file is emitted again when its import graph changed
+    def modules_changed(self, project):
+        configs = self._workspace._configs
+        deps = self._toolchain.module_deps(project, project.options(configs)[configs[0]], self._scanner)
+        graph = { fname: [ [ dep._name, provider ] for dep, provider in providers ] + [ imports ] for fname, (providers, imports) in deps.items() }
+        return self._scanner.changed(project._name, graph)
+
+
+# bumped when the generators change what they write, so existing projects are regenerated
+FORMAT = 2
+
+
+# fingerprint of everything that ends up in a generated project, script edits that do not change it are ignored
+def fingerprint(project, workspace):
+    host = jmake.Env()
+    options = project.options(workspace._configs) # compile_pool and link_pool included
+
+    hooks = {}
+    for config in workspace._configs:
+        for event in [ "prebuild", "postbuild" ]:
+            hooks[config + event] = [ f"{func.__module__}.{func.__qualname__}" for func in project.hooks(config, event) ]
+            # the generated events run the thin client with this interpreter
+            hooks[config + event + "command"] = [ sys.executable ] + hookserver.hook_command(workspace, project, config, event)
+
+    data = {
+            "format": FORMAT,
+            "name": project._name,
+            "target": str(project._target),
+            "files": project._files,
+            "modules": project._modules,
+            "dependencies": [ dep._name if type(dep) == jmake.Project else dep for dep in project._dependencies ],
+            "options": options,
+            "hooks": hooks,
+            # pool lines depend on which pools the root file declares
+            "pools": { name: depth for name, depth in host.pools.items() if depth },
+            "vs": getattr(host, "vs", None),
+            "workspace": [ workspace._name, workspace._configs, workspace.lang, workspace.libc ]
+            }
+    return hashlib.md5(bytes(json.dumps(data, sort_keys=True, default=str), 'utf-8')).hexdigest()
+
+
+def get_cached(workspace):
+    with trace.span("get_cached"):
+        return _get_cached(workspace)
+
+
+def _get_cached(workspace):
     dirty = {}
     host = jmake.Env()
+    projects = workspace._projects.values()
     p = Path(host.bin) / 'jmake/cache.jml'
     if not p.is_file():
         for project in projects:
-            with open(project._module, 'rb') as f:
-                digest = file_digest(f, 'md5')
             dirty[project._name] = {
                     'uuid': str(uuid4()).upper(),
-                    'hash': digest.hexdigest()
+                    'hash': fingerprint(project, workspace)
                     }
+        dirty['_solution'] = { 'uuid': str(uuid4()).upper() }
         p.parent.mkdir(exist_ok=True)
         p.write_text(jmllib.dumps(dirty))
 
@@ -34,24 +137,29 @@ def get_cached(projects):
 
     with open(p) as f:
         cache = jmllib.load(f)
+    # jmllib hoists the fields of nested tables to the top level, keep only project entries
+    cache = { k: v for k, v in cache.items() if type(v) == dict }
 
     all = { 'regenerate': False }
+    # the solution guid is kept stable so the .sln only changes with its content
+    if '_solution' not in cache:
+        dirty['_solution'] = { 'uuid': str(uuid4()).upper() }
+    all['_solution'] = cache.get('_solution') or dirty['_solution']
 
     for project in projects:
-        with open(project._module, 'rb') as f:
-            digest = file_digest(f, 'md5')
+        digest = fingerprint(project, workspace)
         if project._name not in cache:
             dirty[project._name] = {
                 'uuid': str(uuid4()).upper(),
-                'hash': digest.hexdigest()
+                'hash': digest
                     }
             all[project._name] = { 'dirty': True } | dirty[project._name]
             all['regenerate'] = True
             continue
-        if cache[project._name]['hash'] != digest.hexdigest():
+        if cache[project._name]['hash'] != digest:
             dirty[project._name] = {
                 'uuid': cache[project._name]['uuid'],
-                'hash': digest.hexdigest()
+                'hash': digest
                     }
             all[project._name] = { 'dirty': True } | dirty[project._name]
         else:
@@ -61,10 +169,35 @@ def get_cached(projects):
     return all
 
 
+# same as xml.sax.saxutils.escape, which pulls in urllib and slows down every jmake start
+def escape(value, entities={}):
+    value = value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    for key, replacement in entities.items():
+        value = value.replace(key, replacement)
+    return value
+
+
+def xmlattr(name, value):
+    return name + "=\"" + escape(str(value), { "\"": "&quot;" }) + "\""
+
+
+# writes straight to a file handle when given one, otherwise collects chunks for data
 class XMLWriter:
-    def __init__(self):
+    def __init__(self, out=None):
         self.elements = []
-        self.data = """<?xml version="1.0" encoding="utf-8"?>"""
+        self._out = out
+        self._chunks = []
+        self.write("""<?xml version="1.0" encoding="utf-8"?>""")
+
+    @property
+    def data(self):
+        return ''.join(self._chunks)
+
+    def write(self, data):
+        if self._out:
+            self._out.write(data)
+        else:
+            self._chunks.append(data)
 
     def wrap(self, element):
         return "<" + element + ">"
@@ -77,24 +210,24 @@ class XMLWriter:
         self.elements.append(element)
 
         element += " " + properties
-        self.data += "\n" + pad + self.wrap(element.rstrip())
+        self.write("\n" + pad + self.wrap(element.rstrip()))
 
     def pop(self, element):
         while len(self.elements):
             item = self.elements.pop()
             pad = "  " * len(self.elements)
-            self.data += "\n" + pad + self.unwrap(item)
+            self.write("\n" + pad + self.unwrap(item))
             if item == element:
                 break
 
     def item(self, element, value, label=""):
         pad = "  " * len(self.elements)
         left = element + " " + label
-        self.data += "\n" + pad + self.wrap(left.rstrip()) + value + self.unwrap(element)
+        self.write("\n" + pad + self.wrap(left.rstrip()) + escape(value) + self.unwrap(element))
 
     def single(self, value):
         pad = "  " * len(self.elements)
-        self.data += "\n" + pad + self.wrap(value + "/")
+        self.write("\n" + pad + self.wrap(value + "/"))
 
 
 class VSGenerator(Generator):
@@ -122,10 +255,34 @@ class VSGenerator(Generator):
                 jmake.Target.SHARED_LIBRARY: ".dll",
                 jmake.Target.STATIC_LIBRARY: ".lib"
                 }
+        self.sources = [ ".cpp", ".c" ]
         self._uuid = {}
 
-    def vcxproj(self, project):
-        writer = XMLWriter()
+    def condition(self, project, config):
+        return f"Condition=\"'$(Configuration)|$(Platform)'=='{config.capitalize()}|{project['cpu']}'\""
+
+    # source compiling the pch, an empty one is generated when the project does not name one
+    def pch_source(self, project, pch):
+        if pch["source"]:
+            return Path(pch["source"]).absolute()
+        host = jmake.Env()
+        return Path(host.bin).absolute() / f"{project._name}.dir" / "pch" / (Path(pch["header"]).stem + "_pch.cpp")
+
+    def write_pch(self, project):
+        options = project.options(self._workspace._configs)
+        for config in self._workspace._configs:
+            pch = options[config]["pch"]
+            if not pch or pch["source"]:
+                continue
+            path = self.pch_source(project, pch)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            output.write(path, "// creates the precompiled header, the header itself is force included\n")
+
+    def render(self, project):
+        return self.vcxproj(project)
+
+    def vcxproj(self, project, out=None):
+        writer = XMLWriter(out)
         host = jmake.Env()
         xmlns =  "\" xmlns=\"http://schemas.microsoft.com/developer/msbuild/2003\""
         header = "DefaultTargets=\"Build\" ToolsVersion=\"" + self._version[host.vs] + xmlns
@@ -165,7 +322,7 @@ class VSGenerator(Generator):
             target = "StaticLibrary"
 
         for config in self._workspace._configs:
-            condition = f"Condition=\"'$(Configuration)|$(Platform)'=='{config.capitalize()}|{project['cpu']}'\""
+            condition = self.condition(project, config)
             writer.push("PropertyGroup", condition + " Label=\"Configuration\"")
             writer.item("ConfigurationType", target)
             writer.item("PlatformToolset", self._toolset[host.vs])
@@ -185,7 +342,7 @@ class VSGenerator(Generator):
         for config in self._workspace._configs:
             outpath = str(Path(host.bin).absolute() / config.capitalize()) + "\\"
             intpath = project._name + ".dir\\" + config.capitalize() + "\\"
-            condition = f"Condition=\"'$(Configuration)|$(Platform)'=='{config.capitalize()}|{project['cpu']}'\""
+            condition = self.condition(project, config)
             writer.item("OutDir", outpath, condition)
             writer.item("IntDir", intpath, condition)
             writer.item("TargetName", project._name, condition)
@@ -195,7 +352,7 @@ class VSGenerator(Generator):
         writer.pop("PropertyGroup")
 
         for config in self._workspace._configs:
-            condition = f"Condition=\"'$(Configuration)|$(Platform)'=='{config.capitalize()}|{project['cpu']}'\""
+            condition = self.condition(project, config)
             writer.push("ItemDefinitionGroup", condition)
             writer.push("ClCompile")
 
@@ -209,6 +366,9 @@ class VSGenerator(Generator):
                     pm = Path(m[0]).absolute()
                     module.append(f"{pm.stem}={str(p / pm.name)}.ifc")
             writer.item('AdditionalModuleDependencies', ';'.join(module))
+            # msvc runs its own p1689 scan to order the module units of the project
+            if len(project._modules) or len(module):
+                writer.item('ScanSourceForModuleDependencies', 'true')
 
             compile_options = [ "%(AdditionalOptions)" ] + options[config]['compile']
             writer.item("AdditionalOptions", ' '.join(compile_options))
@@ -221,7 +381,15 @@ class VSGenerator(Generator):
                 writer.item("LanguageStandard", self._lang[self._workspace.lang])
             else:
                 writer.item("LanguageStandard_C", self._lang[self._workspace.lang])
-            writer.item("PrecompiledHeader", "NotUsing")
+            pch = options[config]["pch"]
+            if pch:
+                header = str(Path(pch["header"]).absolute())
+                writer.item("PrecompiledHeader", "Use")
+                writer.item("PrecompiledHeaderFile", header)
+                writer.item("PrecompiledHeaderOutputFile", "$(IntDir)" + Path(header).stem + ".pch")
+                writer.item("ForcedIncludeFiles", header)
+            else:
+                writer.item("PrecompiledHeader", "NotUsing")
 
             runtime = "MultiThreaded"
             if options[config]["debug"]:
@@ -272,13 +440,13 @@ class VSGenerator(Generator):
             writer.pop("Link")
 
             writer.push("PreBuildEvent")
-            command = f"python {str(Path(self._workspace._name + '.py').absolute())} prebuild -c {config} -p {project._name}"
+            command = subprocess.list2cmdline([ sys.executable ] + hookserver.hook_command(self._workspace, project, config, "prebuild"))
             writer.item("Command", command)
             writer.item("Message", "jmake prebuild step config=" + config)
             writer.pop("PreBuildEvent")
 
             writer.push("PostBuildEvent")
-            command = f"python {str(Path(self._workspace._name + '.py').absolute())} postbuild -c {config} -p {project._name}"
+            command = subprocess.list2cmdline([ sys.executable ] + hookserver.hook_command(self._workspace, project, config, "postbuild"))
             writer.item("Command", command)
             writer.item("Message", "jmake postbuild step config=" + config)
             writer.pop("PostBuildEvent")
@@ -289,17 +457,56 @@ class VSGenerator(Generator):
 
             writer.pop("ItemDefinitionGroup")
 
+        # unity members stay in the project for the ide but only their unit is compiled
+        units = unity.split(project, self.sources)[0]
+        members = { fname for path, group in units for fname in group }
+
+        # the pch source creates the pch in every config using its header, c sources cannot use a c++ pch
+        creates = {}
+        for config in self._workspace._configs:
+            pch = options[config]["pch"]
+            if pch:
+                creates.setdefault(self.pch_source(project, pch), []).append(config)
+        def metadata(p):
+            res = []
+            if p in creates:
+                res.extend([ ("PrecompiledHeader", "Create", self.condition(project, config)) for config in creates[p] ])
+            elif len(creates) and p.suffix == ".c":
+                res.extend([ ("PrecompiledHeader", "NotUsing", ""), ("ForcedIncludeFiles", "", "") ])
+            return res
+
+        def item(element, p, data):
+            if not len(data):
+                writer.single(element + " " + xmlattr("Include", p))
+                return
+            writer.push(element, xmlattr("Include", p))
+            for name, value, condition in data:
+                writer.item(name, value, condition)
+            writer.pop(element)
+
         writer.push("ItemGroup")
         for fname in project._files:
             p = Path(fname).absolute()
-            element = "ClCompile" if p.suffix in [".cpp", ".c"] else "ClInclude"
-            writer.single(element + " Include=\"" + str(p) + "\"")
+            if p.suffix not in self.sources:
+                item("ClInclude", p, [])
+            elif fname in members:
+                item("ClCompile", p, [ ("ExcludedFromBuild", "true", "") ])
+            else:
+                item("ClCompile", p, metadata(p))
+        for path, group in units:
+            item("ClCompile", path, metadata(path))
+        files = { Path(fname).absolute() for fname in project._files }
+        for path in creates:
+            if path not in files:
+                item("ClCompile", path, metadata(path))
 
         bmipublic = False
         for fname, public in project._modules:
             p = Path(fname).absolute()
-            writer.push('ClCompile', f"Include=\"{str(p)}\"")
+            writer.push('ClCompile', xmlattr("Include", p))
             writer.item('CompileAs', 'CompileAsCppModule')
+            if len(creates):
+                writer.item('PrecompiledHeader', 'NotUsing')
             writer.pop('ClCompile')
             bmipublic = bmipublic or public
         writer.pop("ItemGroup")
@@ -313,7 +520,7 @@ class VSGenerator(Generator):
         for dep in project._dependencies:
             if not jmake.valid_dependency_project(dep): continue
             vcxproj = Path(host.bin).absolute() / (dep._name + ".vcxproj")
-            writer.push("ProjectReference", "Include=\"" + str(vcxproj) + "\"")
+            writer.push("ProjectReference", xmlattr("Include", vcxproj))
             writer.item("Project", "{" + self._uuid[dep._name] + "}")
             writer.item("Name", dep._name)
             writer.pop("ProjectReference")
@@ -325,7 +532,7 @@ class VSGenerator(Generator):
         writer.pop("Project")
         return writer.data
 
-    def sln(self, workspace):
+    def sln(self, workspace, solution):
         data = """
 Microsoft Visual Studio Solution File, Format Version 12.00
 # Visual Studio Version 17
@@ -357,7 +564,7 @@ Microsoft Visual Studio Solution File, Format Version 12.00
                 data += "\n\t\t" + uuid + "." + conf1 + ".Build.0 = " + conf2
         data += "\n\tEndGlobalSection"
         data += "\n\tGlobalSection(ExtensibilityGlobals) = postSolution"
-        data += "\n\t\tSolutionGuid = {" + str(uuid4()) + "}"
+        data += "\n\t\tSolutionGuid = {" + solution + "}"
         data += "\n\tEndGlobalSection"
         data += "\n\tGlobalSection(ExtensibilityAddIns) = postSolution"
         data += "\n\tEndGlobalSection"
@@ -371,30 +578,364 @@ Microsoft Visual Studio Solution File, Format Version 12.00
         host = jmake.Env()
         Path(host.bin).mkdir(exist_ok=True)
 
-        cache = get_cached(workspace._projects.values())
-        for project in workspace._always_build:
+        cache = get_cached(workspace)
+        for project in workspace._always_build if self.force else []:
             cache[project._name]['dirty'] = True
 
         for project in workspace._projects.values():
             self._uuid[project._name] = cache[project._name]['uuid']
-        for project in workspace._projects.values():
-            if not jmake.valid_dependency_project(project) or not cache[project._name]['dirty']:
-                continue
-            data = self.vcxproj(project)
+
+        def prepare(project):
+            unity.write(unity.split(project, self.sources)[0])
+            self.write_pch(project)
             path = Path(host.bin).absolute() / (project._name + ".vcxproj")
-            path.write_text(data)
-        if cache['regenerate']:
-            data = self.sln(workspace)
-            path = Path(host.bin).absolute() / (workspace._name + ".sln")
-            path.write_text(data)
+            if not cache[project._name]['dirty'] and path.is_file():
+                output.manifest.record(path)
+                return None
+            return path
+
+        projects = [ project for project in workspace._projects.values() if jmake.valid_dependency_project(project) ]
+        self.emit(workspace, projects, prepare)
+
+        data = self.sln(workspace, cache['_solution']['uuid'])
+        path = Path(host.bin).absolute() / (workspace._name + ".sln")
+        output.write(path, data)
 
 
 class MakeGenerator(Generator):
     def __init__(self):
-        pass
+        self._workspace = None
+        self._toolchain = None
+        self._scanner = modscan.ModuleScanner()
+        self._tools = {
+                "cc": "$(CC)",
+                "cxx": "$(CXX)"
+                }
+
+    def escape(self, args):
+        return ' '.join([ shlex.quote(str(arg)) for arg in args ]).replace("$", "$$")
+
+    def variable(self, project, config, name):
+        return re.sub(r'\W', '_', f"{project._name}_{config}_{name}")
+
+    def render(self, project):
+        return self.makefile(project)
+
+    def makefile(self, project):
+        tc = self._toolchain
+        host = jmake.Env()
+        mk = Path(host.bin).absolute() / (project._name + ".mk")
+        options = project.options(self._workspace._configs)
+
+        lines = [ f"# {project._name}, generated by jmake" ]
+        lines.append(f".PHONY: {project._name}")
+        lines.append(f"{project._name}: {project._name}.$(CONFIG)")
+        for config in self._workspace._configs:
+            opt = options[config]
+            output = tc.output(project, config)
+            units = tc.units(project)
+            objs = self.variable(project, config, "OBJS")
+            cflags = self.variable(project, config, "CFLAGS")
+            cxxflags = self.variable(project, config, "CXXFLAGS")
+            modflags = self.variable(project, config, "MODFLAGS")
+            ldflags = self.variable(project, config, "LDFLAGS")
+
+            lines.append("")
+            lines.append(f"{objs} := " + ' '.join([ str(tc.object(project, config, fname)) for fname, module in units ]))
+            lines.append(f"{cflags} := " + self.escape(tc.compile_flags(project, opt, "unit.c")))
+            pch = tc.pch(project, opt, config)
+            lines.append(f"{cxxflags} := " + self.escape(tc.compile_flags(project, opt, "unit.cpp", pch=pch)))
+            lines.append(f"{modflags} := " + self.escape(tc.compile_flags(project, opt, "unit.cpp", True)))
+            lines.append(f"{ldflags} := " + self.escape(tc.link_flags(project, opt, config)))
+
+            lines.append(f".PHONY: {project._name}.{config} {project._name}.prebuild.{config}")
+            lines.append(f"{config}: {project._name}.{config}")
+            lines.append(f"{project._name}.{config}: {output}")
+            lines.append(f"{project._name}.prebuild.{config}:")
+            if tc.has_hooks(project, config, "prebuild"):
+                lines.append("\t$(PYTHON) " + self.escape(tc.hook(project, config, "prebuild")))
+
+            # the .gch is built with the c++ flags minus the -include of itself
+            gch = ""
+            if pch:
+                gch = f"{pch}.gch"
+                pchflags = self.variable(project, config, "PCHFLAGS")
+                lines.append(f"{pchflags} := " + self.escape(tc.pch_flags(project, opt)))
+                lines.append(f"{gch}: {pch} {mk} | {project._name}.prebuild.{config}")
+                lines.append("\t@mkdir -p $(@D)")
+                lines.append(f"\t{self._tools['cxx']} $({pchflags}) -MMD -MP -MF $@.d -c -o $@ {pch}")
+                lines.append(f"-include {gch}.d")
+
+            # units only wait for the module interfaces they import, independent interfaces build in parallel
+            deps = tc.module_deps(project, opt, self._scanner)
+            for fname, module in units:
+                providers, imports = deps[fname]
+                obj = tc.object(project, config, fname)
+                src = str(Path(fname).absolute())
+                flags = modflags if module or imports else (cxxflags if tc.is_cxx(fname) else cflags)
+                tool = self._tools["cxx" if tc.is_cxx(fname, module) else "cc"]
+                # the provider objects stand in for their bmi, importers rebuild when an interface changes
+                prereq = ''.join([ f" {tc.object(dep, config, provider)}" for dep, provider in providers ])
+                if gch and flags == cxxflags:
+                    prereq += f" {gch}"
+                lines.append(f"{obj}: {src}{prereq} {mk} | {project._name}.prebuild.{config}")
+                lines.append("\t@mkdir -p $(@D)")
+                command = f"\t{tool} $({flags}) -MMD -MP -MF $@.d -c -o $@ {src}"
+                if module or imports:
+                    command += " && " + tc.strip_modules("$@.d")
+                lines.append(command)
+
+            lines.append(f"-include $({objs}:=.d)")
+
+            inputs = ' '.join([ str(path) for path in tc.link_inputs(project, opt, config) ])
+            if project._target == jmake.Target.STATIC_LIBRARY:
+                lines.append(f"{output}: $({objs}) {mk}")
+                lines.append("\t@mkdir -p $(@D)")
+                lines.append(f"\trm -f $@ && $(AR) rcs $@ $({objs})")
+            else:
+                tool = self._tools[tc.linker(project)]
+                lines.append(f"{output}: $({objs}) {inputs} {mk}")
+                lines.append("\t@mkdir -p $(@D)")
+                lines.append(f"\t{tool} -o $@ $({objs}) $({ldflags})")
+            if tc.has_hooks(project, config, "postbuild"):
+                lines.append("\t$(PYTHON) " + self.escape(tc.hook(project, config, "postbuild")))
+
+        return '\n'.join(lines) + '\n'
+
+    def makefile_root(self, workspace, projects):
+        host = jmake.Env()
+        configs = ' '.join(workspace._configs)
+        lines = [ f"# {workspace._name}, generated by jmake" ]
+        lines.append(f"CONFIG ?= {host.config}")
+        lines.append(f"PYTHON ?= {sys.executable}")
+        lines.append(".DEFAULT_GOAL := all")
+        lines.append(".SUFFIXES:")
+        lines.append(".DELETE_ON_ERROR:")
+        lines.append(f".PHONY: all clean {configs}")
+        lines.append("all: $(CONFIG)")
+        lines.append(f"{configs}:")
+        lines.append("")
+
+        clean = []
+        for project in projects:
+            path = Path(host.bin).absolute() / (project._name + ".mk")
+            lines.append(f"include {path}")
+            clean.append(str(Path(host.bin).absolute() / f"{project._name}.dir"))
+            clean.extend([ str(self._toolchain.output(project, config)) for config in workspace._configs ])
+
+        lines.append("")
+        lines.append("clean:")
+        lines.append("\trm -rf " + ' '.join(clean))
+        return '\n'.join(lines) + '\n'
 
     def generate(self, workspace):
-        pass
+        self._workspace = workspace
+        self._toolchain = toolchain.GCCToolchain(workspace)
+
+        host = jmake.Env()
+        Path(host.bin).mkdir(exist_ok=True)
+
+        cache = get_cached(workspace)
+        for project in workspace._always_build if self.force else []:
+            cache[project._name]['dirty'] = True
+
+        def prepare(project):
+            unity.write(self._toolchain.unity(project))
+            self._toolchain.write_pch(project)
+            path = Path(host.bin).absolute() / (project._name + ".mk")
+            changed = self.modules_changed(project)
+            if not cache[project._name]['dirty'] and path.is_file() and not changed:
+                output.manifest.record(path)
+                return None
+            return path
+
+        projects = [ project for project in workspace._projects.values() if jmake.valid_dependency_project(project) ]
+        self.emit(workspace, projects, prepare)
+        self._scanner.save()
+
+        data = self.makefile_root(workspace, projects)
+        path = Path(host.bin).absolute() / "Makefile"
+        output.write(path, data)
+        print(f"run 'make -C {host.bin} -j{host.vcpu}' to build")
+
+
+class NinjaGenerator(Generator):
+    def __init__(self):
+        self._workspace = None
+        self._toolchain = None
+        self._scanner = modscan.ModuleScanner()
+
+    def path(self, p):
+        return str(p).replace("$", "$$").replace(" ", "$ ").replace(":", "$:")
+
+    def escape(self, args):
+        return ' '.join([ shlex.quote(str(arg)) for arg in args ]).replace("$", "$$")
+
+    # pools without a depth in Env.pools are not declared, their edges are only limited by -j
+    def pool(self, name):
+        host = jmake.Env()
+        if name == "console" or host.pools.get(name):
+            return [ f"  pool = {name}" ]
+        return []
+
+    def render(self, project):
+        return self.ninja(project)
+
+    def ninja(self, project):
+        tc = self._toolchain
+        options = project.options(self._workspace._configs)
+
+        lines = [ f"# {project._name}, generated by jmake" ]
+        for config in self._workspace._configs:
+            opt = options[config]
+            output = tc.output(project, config)
+            prebuild = f"{project._name}.prebuild.{config}"
+
+            lines.append("")
+            if tc.has_hooks(project, config, "prebuild"):
+                lines.append(f"build {prebuild}: hook")
+                lines.append("  args = " + self.escape(tc.hook(project, config, "prebuild")))
+                lines.extend(self.pool("hook"))
+            else:
+                lines.append(f"build {prebuild}: phony")
+
+            pch = tc.pch(project, opt, config)
+            gch = ""
+            if pch:
+                gch = self.path(f"{pch}.gch")
+                lines.append(f"build {gch}: cxx {self.path(pch)} || {prebuild}")
+                lines.append("  flags = " + self.escape(tc.pch_flags(project, opt)))
+                lines.extend(self.pool(opt["compile_pool"]))
+
+            # units only wait for the module interfaces they import, independent interfaces build in parallel
+            deps = tc.module_deps(project, opt, self._scanner)
+            objs = []
+            for fname, module in tc.units(project):
+                providers, imports = deps[fname]
+                obj = self.path(tc.object(project, config, fname))
+                rule = "cxx" if tc.is_cxx(fname, module) else "cc"
+                if module or imports:
+                    rule = "cxxm"
+                implicit = [ self.path(tc.object(dep, config, provider)) for dep, provider in providers ]
+                if gch and tc.is_cxx(fname) and not module and not imports:
+                    implicit.append(gch)
+                implicit = " | " + ' '.join(implicit) if len(implicit) else ""
+                lines.append(f"build {obj}: {rule} {self.path(Path(fname).absolute())}{implicit} || {prebuild}")
+                lines.append("  flags = " + self.escape(tc.compile_flags(project, opt, fname, module or imports, pch)))
+                lines.extend(self.pool(opt["compile_pool"]))
+                objs.append(obj)
+
+            post = ""
+            if tc.has_hooks(project, config, "postbuild"):
+                post = " && $python " + self.escape(tc.hook(project, config, "postbuild"))
+            if project._target == jmake.Target.STATIC_LIBRARY:
+                lines.append(f"build {self.path(output)}: ar " + ' '.join(objs))
+            else:
+                inputs = ' '.join([ self.path(path) for path in tc.link_inputs(project, opt, config) ])
+                lines.append(f"build {self.path(output)}: link " + ' '.join(objs) + (f" | {inputs}" if inputs else ""))
+                lines.append("  ld = $" + tc.linker(project))
+                lines.append("  ldflags = " + self.escape(tc.link_flags(project, opt, config)))
+            lines.append(f"  post = {post}")
+            lines.extend(self.pool(opt["link_pool"]))
+            lines.append(f"build {project._name}.{config}: phony {self.path(output)}")
+
+        return '\n'.join(lines) + '\n'
+
+    def ninja_root(self, workspace, projects):
+        host = jmake.Env()
+        bindir = Path(host.bin).absolute()
+        script = Path(workspace._name + ".py").absolute()
+        scripts = { str(script) } | { str(project._module) for project in workspace._projects.values() if project._module }
+
+        lines = [ f"# {workspace._name}, generated by jmake" ]
+        lines.append("ninja_required_version = 1.7")
+        lines.append(f"builddir = {self.path(bindir)}")
+        lines.append(f"cc = {os.environ.get('CC', 'cc')}")
+        lines.append(f"cxx = {os.environ.get('CXX', 'c++')}")
+        lines.append(f"ar = {os.environ.get('AR', 'ar')}")
+        lines.append(f"python = {self.path(sys.executable)}")
+        lines.append("")
+        for name, depth in host.pools.items():
+            if depth and name != "console":
+                lines.append(f"pool {name}")
+                lines.append(f"  depth = {depth}")
+        lines.append("")
+        lines.append("rule cc")
+        lines.append("  command = $cc $flags -MMD -MF $out.d -c -o $out $in")
+        lines.append("  depfile = $out.d")
+        lines.append("  deps = gcc")
+        lines.append("  description = CC $out")
+        lines.append("rule cxx")
+        lines.append("  command = $cxx $flags -MMD -MF $out.d -c -o $out $in")
+        lines.append("  depfile = $out.d")
+        lines.append("  deps = gcc")
+        lines.append("  description = CXX $out")
+        lines.append("rule cxxm")
+        lines.append("  command = $cxx $flags -MMD -MF $out.d -c -o $out $in && " + self._toolchain.strip_modules("$out.d"))
+        lines.append("  depfile = $out.d")
+        lines.append("  deps = gcc")
+        lines.append("  description = CXX $out")
+        lines.append("rule ar")
+        lines.append("  command = rm -f $out && $ar rcs $out $in$post")
+        lines.append("  description = AR $out")
+        lines.append("rule link")
+        lines.append("  command = $ld -o $out $in $ldflags$post")
+        lines.append("  description = LINK $out")
+        lines.append("rule hook")
+        lines.append("  command = $python $args")
+        lines.append("  description = HOOK $out")
+        lines.append("rule regen")
+        lines.append(f"  command = cd {self.path(script.parent)} && $python {self.path(script)} generate")
+        lines.append("  description = REGEN build.ninja")
+        lines.append("  generator = 1")
+        lines.append("  restat = 1")
+        lines.append("")
+        lines.append(f"build build.ninja: regen " + ' '.join([ self.path(p) for p in sorted(scripts) ]))
+        lines.append("")
+
+        # the digests make build.ninja change with any subninja so ninja reloads the manifest after regen
+        for project in projects:
+            path = bindir / (project._name + '.ninja')
+            digest = hashlib.md5(path.read_bytes()).hexdigest() if path.is_file() else ""
+            lines.append(f"# {project._name} {digest}")
+            lines.append(f"subninja {self.path(path)}")
+        lines.append("")
+
+        for config in workspace._configs:
+            targets = ' '.join([ f"{project._name}.{config}" for project in projects ])
+            lines.append(f"build {config}: phony {targets}")
+        lines.append(f"default {host.config}")
+        return '\n'.join(lines) + '\n'
+
+    def generate(self, workspace):
+        self._workspace = workspace
+        self._toolchain = toolchain.GCCToolchain(workspace)
+
+        host = jmake.Env()
+        Path(host.bin).mkdir(exist_ok=True)
+
+        cache = get_cached(workspace)
+        for project in workspace._always_build if self.force else []:
+            cache[project._name]['dirty'] = True
+
+        def prepare(project):
+            unity.write(self._toolchain.unity(project))
+            self._toolchain.write_pch(project)
+            path = Path(host.bin).absolute() / (project._name + ".ninja")
+            changed = self.modules_changed(project)
+            if not cache[project._name]['dirty'] and path.is_file() and not changed:
+                output.manifest.record(path)
+                return None
+            return path
+
+        projects = [ project for project in workspace._projects.values() if jmake.valid_dependency_project(project) ]
+        self.emit(workspace, projects, prepare)
+        self._scanner.save()
+
+        data = self.ninja_root(workspace, projects)
+        path = Path(host.bin).absolute() / "build.ninja"
+        output.write(path, data)
+        print(f"run 'ninja -C {host.bin}' to build")
 
 
 def factory(name):
@@ -402,4 +943,6 @@ def factory(name):
         return VSGenerator()
     elif name == "make":
         return MakeGenerator()
+    elif name == "ninja":
+        return NinjaGenerator()
     return None
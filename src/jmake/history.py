@@ -0,0 +1,83 @@
+from pathlib import Path
+import threading
+import json
+import os
+
+from . import jmake
+
+
+# per action measurements of previous builds in bin/jmake/actions.json, keyed on the action's first output
+class ActionHistory:
+    VERSION = 1
+
+    def __init__(self, path=None):
+        self._path = path
+        self._actions = None
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def path(self):
+        if self._path is None:
+            host = jmake.Env()
+            return Path(host.bin).absolute() / "jmake" / "actions.json"
+        return Path(self._path)
+
+    def _load(self):
+        if self._actions is not None:
+            return
+        self._actions = {}
+        p = self.path()
+        if not p.is_file():
+            return
+        try:
+            data = json.loads(p.read_text())
+        except json.JSONDecodeError:
+            return
+        if data.get("version") == self.VERSION:
+            self._actions = data["actions"]
+
+    def get(self, key):
+        with self._lock:
+            self._load()
+            return self._actions.get(key, {})
+
+    def record(self, key, kind, **values):
+        with self._lock:
+            self._load()
+            entry = self._actions.setdefault(key, { "kind": kind })
+            for k, v in values.items():
+                if v is not None and entry.get(k) != v:
+                    entry[k] = v
+                    self._changed = True
+
+    # mean of a measurement over every recorded action of a kind, None if nothing was recorded
+    def mean(self, kind, value):
+        with self._lock:
+            self._load()
+            values = [ entry[value] for entry in self._actions.values() if entry["kind"] == kind and value in entry ]
+        return sum(values) / len(values) if len(values) else None
+
+    def save(self):
+        if not self._changed:
+            return
+        p = self.path()
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_suffix(f".{os.getpid()}")
+        tmp.write_text(json.dumps({ "version": self.VERSION, "actions": self._actions }))
+        os.replace(tmp, p)
+        self._changed = False
+
+
+# memory the system can hand out without swapping in bytes, None where it cannot be read
+def available_memory():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
@@ -0,0 +1,40 @@
+# thin client for the jmake hook server, run by path so it only imports the standard library
+# usage: hookclient.py <state file> <build script> <event> -c <config> -p <project>
+import subprocess
+import socket
+import json
+import sys
+
+
+def request(state, args):
+    with open(state) as f:
+        info = json.load(f)
+    with socket.create_connection(("127.0.0.1", info["port"]), timeout=2) as s:
+        s.settimeout(None)
+        s.sendall(bytes(json.dumps({ "token": info["token"], "args": args }) + "\n", 'utf-8'))
+        data = b""
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data)
+
+
+def main():
+    state, script, args = sys.argv[1], sys.argv[2], sys.argv[3:]
+    try:
+        res = request(state, args)
+        if res["status"] != "stale":
+            sys.stdout.write(res["output"])
+            sys.stdout.flush()
+            return res["status"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # no server running, run the hook by evaluating the build script
+    return subprocess.call([ sys.executable, script ] + args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+from pathlib import Path
+import socketserver
+import contextlib
+import traceback
+import argparse
+import secrets
+import json
+import time
+import io
+import os
+
+from . import jmake
+
+
+def state_path():
+    host = jmake.Env()
+    return Path(host.bin).absolute() / "jmake" / "hooks.json"
+
+
+# command running a hook through the thin client, it falls back to the build script when no server is up
+def hook_command(workspace, project, config, event):
+    client = Path(__file__).parent / "hookclient.py"
+    script = Path(workspace._name + ".py").absolute()
+    return [ str(client), str(state_path()), str(script), event, "-c", config, "-p", project._name ]
+
+
+# keeps the evaluated workspace in memory and runs pre/postbuild hooks on request
+class HookServer:
+    def __init__(self, workspace):
+        host = jmake.Env()
+        self._workspace = workspace
+        self._token = secrets.token_hex(16)
+        scripts = { Path(workspace._name + ".py").absolute() }
+        scripts |= { Path(project._module) for project in workspace._projects.values() if project._module }
+        self._scripts = { str(p): os.stat(p).st_mtime_ns for p in scripts if p.is_file() }
+        self._parser = argparse.ArgumentParser(add_help=False)
+        self._parser.add_argument('event', choices=[ 'prebuild', 'postbuild' ])
+        self._parser.add_argument('-c')
+        self._parser.add_argument('-p')
+        self._last = time.monotonic()
+        self.stale = False
+
+    # the workspace is only valid while none of the scripts it was evaluated from changed
+    def check(self):
+        for fname, mtime in self._scripts.items():
+            try:
+                if os.stat(fname).st_mtime_ns != mtime:
+                    self.stale = True
+            except FileNotFoundError:
+                self.stale = True
+        return not self.stale
+
+    def handle(self, request):
+        if request.get("token") != self._token:
+            return { "status": 1, "output": "invalid token\n" }
+        if not self.check():
+            return { "status": "stale", "output": "" }
+
+        self._last = time.monotonic()
+        host = jmake.Env()
+        out = io.StringIO()
+        status = 0
+        mode = host.mode
+        try:
+            args = self._parser.parse_args(request["args"])
+            host.mode = args.event
+            host.config = args.c
+            with contextlib.redirect_stdout(out):
+                print(f"running {args.event} events...")
+                project = self._workspace[args.p]
+                getattr(project, args.event)(args.c)
+        except BaseException:
+            out.write(traceback.format_exc())
+            status = 1
+        finally:
+            host.mode = mode
+        return { "status": status, "output": out.getvalue() }
+
+    # serve until a build script changes or no request arrived for idle seconds
+    def serve(self, idle=None):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                request = json.loads(self.rfile.readline())
+                response = server.handle(request)
+                self.wfile.write(bytes(json.dumps(response), 'utf-8'))
+
+        with socketserver.TCPServer(("127.0.0.1", 0), Handler) as tcp:
+            tcp.timeout = 1
+            state = state_path()
+            state.parent.mkdir(parents=True, exist_ok=True)
+            state.write_text(json.dumps({ "port": tcp.server_address[1], "token": self._token, "pid": os.getpid() }))
+            os.chmod(state, 0o600)
+            print(f"hook server listening on port {tcp.server_address[1]}")
+            try:
+                while self.check():
+                    tcp.handle_request()
+                    if idle is not None and time.monotonic() - self._last > idle:
+                        print("hook server idle, stopping")
+                        break
+            except KeyboardInterrupt:
+                pass
+            finally:
+                state.unlink(missing_ok=True)
+            if self.stale:
+                print("build scripts changed, stopping hook server")
@@ -3,6 +3,8 @@ import sys
 import os
 import platform
 
+from . import trace
+
 
 Target = Enum('Target', [
     'EXECUTABLE',
@@ -19,6 +21,12 @@ Platform = Enum('Platform', [
     ])
 
 
+class DependencyCycle(Exception):
+    def __init__(self, path):
+        self.path = path
+        super().__init__("dependency cycle " + " -> ".join(path))
+
+
 class Env:
     _instance = None
     def __new__(cls):
@@ -45,12 +53,25 @@ class Env:
         self.lib = "lib"
         self.bin = "bin"
         self.config = "debug"
+        self.cache_size = 5 << 30 # object cache size cap in bytes, 0 disables it
+        self.workers = [ w for w in os.environ.get("JMAKE_WORKERS", "").split(",") if w ] # "host:port" of jmake workers
+        self.worker_token = os.environ.get("JMAKE_WORKER_TOKEN")
+        self.workers_file = "~/.config/jmake/workers.json" # read when workers is empty
+        self.worker_timeout = 300 # seconds a remote compile may take before its worker is dropped
+        # concurrent actions per job pool, 0 only limits by -j, link steps are memory hungry so they get half the cores
+        self.pools = {
+                "compile": 0,
+                "link": max(1, (self.vcpu or 1) // 2),
+                "hook": 1
+                }
         self.mode = None
         self.paths = [] # stack of paths
         self.module = ''
 
 
 class Project:
+    _generation = 0 # bumped by every mutation to invalidate cached closures and options
+
     def __init__(self, name, target):
         host = Env()
         self._module = host.module # internal use for caching
@@ -58,6 +79,7 @@ class Project:
         self._name = name
         self._target = target
         self._files = []
+        self._fileset = set()
         self._modules = [] # list of tuple(fname: str, public: bool)
         self._defines = {}
         self._dependencies = []
@@ -66,15 +88,19 @@ class Project:
         self._compile = []
         self._link = []
 
-        # for binary only projects
-        self.includes = []
-        self.binaries = []
-        self.libpaths = []
+        # for binary only projects, set through export() or assignment so cached options are invalidated
+        self._includes = []
+        self._binaries = []
+        self._libpaths = []
 
         self._options = {}
+        self._pch = None # dict(header, source), a filter overrides the project's
         self._filters = {}
         self._prebuild = []
         self._postbuild = []
+        self._closure = None
+        self._resolved = {}
+        self._unity = None # tuple(generation, sources, split) of the last unity.split
         self._default_options()
 
     def _default_options(self):
@@ -84,44 +110,92 @@ class Project:
         self["binary_only"] = False
         self["optimization"] = False
         self['cpu'] = 'x64'
-
+        self["unity"] = 0 # sources per unity translation unit, 0 disables unity builds
+        self["unity_exclude"] = [] # file name or path patterns compiled on their own
+        self["compile_pool"] = "compile" # job pools from Env.pools the project's actions run in
+        self["link_pool"] = "link"
+        self["compile_memory"] = 0 # expected peak memory per action in MiB until a build measured it
+        self["link_memory"] = 0
+
+    def _touch(self):
+        Project._generation += 1
+
+    # read only views, appending to them in place would leave cached options stale
+    @property
+    def includes(self):
+        return tuple(self._includes)
+
+    @includes.setter
+    def includes(self, includes):
+        self._touch()
+        self._includes = list(includes)
+
+    @property
+    def binaries(self):
+        return tuple(self._binaries)
+
+    @binaries.setter
+    def binaries(self, binaries):
+        self._touch()
+        self._binaries = list(binaries)
+
+    @property
+    def libpaths(self):
+        return tuple(self._libpaths)
+
+    @libpaths.setter
+    def libpaths(self, libpaths):
+        self._touch()
+        self._libpaths = list(libpaths)
+
+    # duplicated file names are dropped, the first occurence keeps its place
     def add(self, files):
+        self._touch()
         if type(files) == str:
-            self._files.append(files)
+            files = [ files ]
         if type(files) == list:
-            self._files.extend(files)
+            for fname in files:
+                if fname not in self._fileset:
+                    self._fileset.add(fname)
+                    self._files.append(fname)
 
     def add_module(self, modules, public=False):
+        self._touch()
         if type(modules) == str:
             self._modules.append((modules, public))
         if type(modules) == list:
             self._modules.extend([ (module, public) for module in modules ])
 
     def include(self, dirs):
+        self._touch()
         if type(dirs) == str:
             self._include_dirs.append(dirs)
         if type(dirs) == list:
             self._include_dirs.extend(dirs)
 
     def compile(self, options):
+        self._touch()
         if type(options) == str:
             self._compile.append(options)
         if type(options) == list:
             self._compile.extend(options)
 
     def link(self, options):
+        self._touch()
         if type(options) == str:
             self._link.append(options)
         if type(options) == list:
             self._link.extend(options)
 
     def libpath(self, dirs):
+        self._touch()
         if type(dirs) == str:
             self._library_dirs.append(dirs)
         if type(dirs) == list:
             self._library_dirs.extend(dirs)
 
     def depend(self, dependency):
+        self._touch()
         if type(dependency) in [ str, Project ]:
             self._dependencies.append(dependency)
         if type(dependency) == list:
@@ -130,78 +204,123 @@ class Project:
             self._dependencies.extend(dependency.libraries())
 
     def export(self, includes=None, binaries=None, libpaths=None, append=False):
+        self._touch()
         if includes:
             if type(includes) != list:
                 includes = [ includes ]
             if append:
-                self.includes.extend(includes)
+                self._includes.extend(includes)
             else:
-                self.includes = includes
+                self._includes = list(includes)
         if binaries:
             if type(binaries) != list:
                 binaries = [ binaries ]
             if append:
-                self.binaries.extend(binaries)
+                self._binaries.extend(binaries)
             else:
-                self.binaries = binaries
+                self._binaries = list(binaries)
         if libpaths:
             if type(libpaths) != list:
                 libpaths = [ libpaths ]
             if append:
-                self.libpaths.extend(binaries)
+                self._libpaths.extend(libpaths)
             else:
-                self.libpaths = libpaths
+                self._libpaths = list(libpaths)
 
     def filter(self, config):
+        self._touch()
         f = Project(config, self._target)
         f._options = self._options.copy()
         self._filters[config] = f
         return f
 
-    def dependencies(self):
-        dependencies = set()
+    # precompiled header for the c++ sources, source creates the pch on msvc and is generated if not given
+    # a filter disables the project's pch with pch(None)
+    def pch(self, header, source=None):
+        self._touch()
+        # accept the single item lists returned by fullpath()
+        if type(header) == list:
+            header = header[0]
+        if type(source) == list:
+            source = source[0]
+        self._pch = { "header": header, "source": source }
+
+    # transitive dependencies in first seen order, static libraries pass on their own dependencies
+    def dependencies(self, path=[]):
+        if self._closure and self._closure[0] == Project._generation:
+            return self._closure[1]
+
+        path = path + [ self ]
+        dependencies = []
+        seen = set()
+        def append(dependency):
+            if dependency not in seen:
+                seen.add(dependency)
+                dependencies.append(dependency)
+
         for dependency in self._dependencies:
-            dependencies.add(dependency)
+            append(dependency)
             if type(dependency) == Project and dependency._target == Target.STATIC_LIBRARY:
-                dependencies |= dependency.dependencies()
+                if dependency in path:
+                    raise DependencyCycle([ p._name for p in path ] + [ dependency._name ])
+                for dep in dependency.dependencies(path):
+                    append(dep)
+
+        self._closure = (Project._generation, dependencies)
         return dependencies
 
+    # resolved options per config, cached until any project is mutated
     def options(self, configs):
         opt = {}
         for config in configs:
-            projfilter = self._filters[config] if config in self._filters else self
-            opt[config] = projfilter._options | {}
-            opt[config]["defines"] = self._defines | projfilter._defines
-            inc = self._include_dirs + (projfilter._include_dirs if config in self._filters else [])
-            lib = self._library_dirs + (projfilter._library_dirs if config in self._filters else [])
-            dep = []
-            mod = {}
-            for dependency in self.dependencies():
-                if type(dependency) == str:
-                    dep.append(dependency)
-                if type(dependency) == Project:
-                    inc.extend(dependency.includes)
-                    dep.extend(dependency.binaries)
-                    lib.extend(dependency.libpaths)
-                    if valid_dependency_project(dependency):
-                        dep.append(dependency._name)
-                    mod[dependency._name] = [ module for module, public in dependency._modules if public ]
-
-            opt[config]["includes"] = inc
-            opt[config]["libpaths"] = lib
-            opt[config]["depends"] = dep
-            opt[config]["modules"] = mod
-            opt[config]["compile"] = self._compile
-            opt[config]["link"] = self._link
-
-        # remove duplicated file names
-        unique = { fname for fname in self._files }
-        self._files = [ fname for fname in unique ]
+            if config not in self._resolved or self._resolved[config][0] != Project._generation:
+                with trace.span("options " + self._name, cat="options", args={ "config": config }):
+                    self._resolved[config] = (Project._generation, self._resolve(config))
+            # callers get their own containers so changing them does not leak into the cache or the project
+            opt[config] = _copy(self._resolved[config][1])
+        return opt
+
+    def _resolve(self, config):
+        projfilter = self._filters[config] if config in self._filters else self
+        opt = projfilter._options | {}
+        opt["defines"] = self._defines | projfilter._defines
+        pch = projfilter._pch if config in self._filters and projfilter._pch is not None else self._pch
+        opt["pch"] = pch if pch and pch["header"] else None
+        inc = self._include_dirs + (projfilter._include_dirs if config in self._filters else [])
+        lib = self._library_dirs + (projfilter._library_dirs if config in self._filters else [])
+        dep = []
+        mod = {}
+        for dependency in self.dependencies():
+            if type(dependency) == str:
+                dep.append(dependency)
+            if type(dependency) == Project:
+                inc.extend(dependency.includes)
+                dep.extend(dependency.binaries)
+                lib.extend(dependency.libpaths)
+                if valid_dependency_project(dependency):
+                    dep.append(dependency._name)
+                mod[dependency._name] = [ module for module, public in dependency._modules if public ]
+
+        # dedupe while keeping the first occurence so generated files are stable between runs
+        opt["includes"] = list(dict.fromkeys(inc))
+        opt["libpaths"] = list(dict.fromkeys(lib))
+        opt["depends"] = list(dict.fromkeys(dep))
+        opt["modules"] = mod
+        opt["compile"] = list(self._compile)
+        opt["link"] = list(self._link)
         return opt
 
     def define(self, key, value):
+        self._touch()
         self._defines[key] = value
 
+    # hook functions registered for an event, project wide ones first
+    def hooks(self, config, event):
+        hooks = self._prebuild if event == "prebuild" else self._postbuild
+        if config in self._filters:
+            hooks = hooks + self._filters[config].hooks(config, event)
+        return hooks
+
     def prebuild(self, config):
         for func in self._prebuild:
             func(self)
@@ -218,9 +337,11 @@ class Project:
         return self._options[key]
 
     def __setitem__(self, key, val):
+        self._touch()
         self._options[key] = val
 
     def __delitem__(self, key):
+        self._touch()
         del self._defines[key]
 
 
@@ -229,6 +350,7 @@ class Workspace:
         self._name = name
         self._projects = {}
         self._always_build = []
+        self._graph = None
         self._configs = ["debug", "release"]
         self.lang = "cpp17"
         self.libc = "mt"
@@ -251,6 +373,34 @@ class Workspace:
             deps = [ dep for dep in p._dependencies if valid_dependency_project(dep) ]
             self._add(deps)
 
+    # every project ordered so dependencies come first, raises DependencyCycle with the offending path
+    def graph(self):
+        if self._graph and self._graph[0] == Project._generation:
+            return self._graph[1]
+
+        order = []
+        done = set()
+        def visit(project, path):
+            if project._name in done:
+                return
+            if project in path:
+                cycle = path[path.index(project):] + [ project ]
+                raise DependencyCycle([ p._name for p in cycle ])
+            for dependency in project._dependencies:
+                if type(dependency) == Project:
+                    visit(dependency, path + [ project ])
+            done.add(project._name)
+            order.append(project)
+            # pick up dependencies added after the workspace
+            if project._name not in self._projects and valid_dependency_project(project):
+                self._projects[project._name] = project
+
+        for project in list(self._projects.values()):
+            visit(project, [])
+        order = [ project for project in order if project._name in self._projects ]
+        self._graph = (Project._generation, order)
+        return order
+
     def libraries(self):
         targets = [ Target.SHARED_LIBRARY, Target.STATIC_LIBRARY, Target.HEADER_LIBRARY ]
         libs = [project for project in self._projects.values() if project._target in targets ]
@@ -261,6 +411,14 @@ class Workspace:
 
 
 # check if a dependency is a valid project
+def _copy(value):
+    if type(value) == list:
+        return list(value)
+    if type(value) == dict:
+        return { k: _copy(v) for k, v in value.items() }
+    return value
+
+
 def valid_dependency_project(project):
     if type(project) != Project: return False
     return (not project['binary_only']) and (project._target != Target.HEADER_LIBRARY)
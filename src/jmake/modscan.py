@@ -0,0 +1,140 @@
+from pathlib import Path
+from hashlib import md5
+import json
+import os
+import re
+
+from . import jmake
+
+_comment = re.compile(r'//[^\n]*|/\*.*?\*/', re.S)
+_declaration = re.compile(r'^[ \t]*(export[ \t]+)?module[ \t]+([\w.]+)(:[\w.]+)?[ \t]*;', re.M)
+_import = re.compile(r'^[ \t]*(?:export[ \t]+)?import[ \t]+([\w.]+|:[\w.]+)[ \t]*;', re.M)
+
+
+# P1689 style rule of a translation unit, header units and the standard library modules are not tracked
+def scan_text(text):
+    text = _comment.sub(' ', text)
+    provides = []
+    requires = []
+    name = None
+    m = _declaration.search(text)
+    if m:
+        name = m.group(2)
+        partition = m.group(3) or ""
+        if m.group(1) or partition:
+            provides.append({ "logical-name": name + partition, "is-interface": bool(m.group(1)) })
+        else:
+            # a module implementation unit implicitly imports its interface
+            requires.append({ "logical-name": name })
+    for m in _import.finditer(text):
+        imported = m.group(1)
+        if imported.startswith(":"):
+            if name is None:
+                continue
+            imported = name + imported
+        requires.append({ "logical-name": imported })
+    return { "provides": provides, "requires": requires }
+
+
+# scan results are cached per source content hash in bin/jmake/modscan.json, sources are only hashed again when
+# their stamp changes
+class ModuleScanner:
+    VERSION = 1
+
+    def __init__(self, path=None):
+        self._path = path
+        self._sources = None
+        self._rules = None
+        self._graphs = None
+        self._changed = False
+
+    def path(self):
+        if self._path is None:
+            host = jmake.Env()
+            return Path(host.bin).absolute() / "jmake" / "modscan.json"
+        return Path(self._path)
+
+    def _load(self):
+        if self._sources is not None:
+            return
+        self._sources = {}
+        self._rules = {}
+        self._graphs = {}
+        p = self.path()
+        if not p.is_file():
+            return
+        try:
+            data = json.loads(p.read_text())
+        except json.JSONDecodeError:
+            return
+        if data.get("version") == self.VERSION:
+            self._sources = data["sources"]
+            self._rules = data["rules"]
+            self._graphs = data["graphs"]
+
+    def scan(self, fname):
+        self._load()
+        fname = str(Path(fname).absolute())
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return { "provides": [], "requires": [] }
+        stamp = [ st.st_mtime_ns, st.st_size ]
+        entry = self._sources.get(fname)
+        if entry and entry["stamp"] == stamp and entry["hash"] in self._rules:
+            return self._rules[entry["hash"]]
+
+        with open(fname, 'rb') as f:
+            data = f.read()
+        h = md5(data).hexdigest()
+        if h not in self._rules:
+            self._rules[h] = scan_text(data.decode('utf-8', errors='replace'))
+        self._sources[fname] = { "stamp": stamp, "hash": h }
+        self._changed = True
+        return self._rules[h]
+
+    def provides(self, fname):
+        return [ p["logical-name"] for p in self.scan(fname)["provides"] ]
+
+    def requires(self, fname):
+        return [ r["logical-name"] for r in self.scan(fname)["requires"] ]
+
+    # returns true if the module graph stored under key differs from graph, and stores graph
+    def changed(self, key, graph):
+        digest = md5(bytes(json.dumps(graph, sort_keys=True), 'utf-8')).hexdigest()
+        self._load()
+        if self._graphs.get(key) == digest:
+            return False
+        self._graphs[key] = digest
+        self._changed = True
+        return True
+
+    def save(self):
+        if not self._changed or self._sources is None:
+            return
+        used = { entry["hash"] for entry in self._sources.values() }
+        self._rules = { h: rule for h, rule in self._rules.items() if h in used }
+        p = self.path()
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_suffix(f".{os.getpid()}")
+        tmp.write_text(json.dumps({ "version": self.VERSION, "sources": self._sources, "rules": self._rules, "graphs": self._graphs }))
+        os.replace(tmp, p)
+        self._changed = False
+
+
+# raises DependencyCycle if units import each other in a cycle, deps maps a unit to the units it requires
+def check(deps):
+    done = set()
+    def visit(unit, path):
+        if unit in done:
+            return
+        if unit in path:
+            cycle = path[path.index(unit):] + [ unit ]
+            raise jmake.DependencyCycle([ Path(str(u)).name for u in cycle ])
+        path = path + [ unit ]
+        for dep in deps.get(unit, []):
+            visit(dep, path)
+        done.add(unit)
+
+    for unit in deps:
+        visit(unit, [])
@@ -0,0 +1,103 @@
+from pathlib import Path
+import subprocess
+import threading
+import hashlib
+import shutil
+import json
+import os
+
+from . import jmake
+
+
+# ccache style object cache keyed on the preprocessed source, the compiler and its flags
+class ObjectCache:
+    def __init__(self, path=None, size=None):
+        host = jmake.Env()
+        self._path = Path(path) if path else Path(host.bin).absolute() / "jmake" / "objcache"
+        self._size = size if size is not None else host.cache_size
+        self._lock = threading.Lock()
+        self._identity = {}
+        self.stats = { "hits": 0, "misses": 0, "evictions": 0 }
+
+    # the compiler identity covers its resolved path, version string and binary timestamp
+    def identity(self, tool):
+        with self._lock:
+            if tool in self._identity:
+                return self._identity[tool]
+        exe = shutil.which(tool) or tool
+        res = subprocess.run([ exe, "--version" ], capture_output=True, text=True)
+        mtime = os.stat(exe).st_mtime_ns if os.path.exists(exe) else 0
+        identity = f"{os.path.realpath(exe)}\n{mtime}\n{res.stdout}"
+        with self._lock:
+            self._identity[tool] = identity
+        return identity
+
+    def key(self, tool, flags, preprocessed):
+        h = hashlib.sha256()
+        h.update(bytes(self.identity(tool), 'utf-8'))
+        h.update(bytes('\0'.join(flags), 'utf-8'))
+        h.update(preprocessed)
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return self._path / key[:2] / key
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    # restore a cached object, returns the compiler output recorded with it or None on a miss
+    def fetch(self, key, obj):
+        entry = self._entry(key)
+        try:
+            shutil.copyfile(entry.with_suffix(".o"), obj)
+            out = entry.with_suffix(".txt")
+            text = out.read_text() if out.is_file() else ""
+            os.utime(entry.with_suffix(".o")) # mark as recently used
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return text
+
+    def store(self, key, obj, text=""):
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        if text:
+            tmp = entry.with_suffix(f".txt.{os.getpid()}.{threading.get_ident()}")
+            tmp.write_text(text)
+            os.replace(tmp, entry.with_suffix(".txt"))
+        tmp = entry.with_suffix(f".o.{os.getpid()}.{threading.get_ident()}")
+        shutil.copyfile(obj, tmp)
+        os.replace(tmp, entry.with_suffix(".o"))
+
+    # drop least recently used entries until the cache fits in its size cap
+    def evict(self):
+        if not self._path.is_dir():
+            return
+        entries = []
+        total = 0
+        for p in self._path.glob("*/*.o"):
+            st = p.stat()
+            entries.append((st.st_mtime_ns, st.st_size, p))
+            total += st.st_size
+        entries.sort()
+        for _, size, p in entries:
+            if total <= self._size:
+                break
+            p.unlink(missing_ok=True)
+            p.with_suffix(".txt").unlink(missing_ok=True)
+            total -= size
+            self.stats["evictions"] += 1
+
+    # cumulative statistics are kept next to the cache
+    def save(self):
+        p = self._path / "stats.json"
+        total = { "hits": 0, "misses": 0, "evictions": 0 }
+        if p.is_file():
+            total |= json.loads(p.read_text())
+        for k, v in self.stats.items():
+            total[k] += v
+        self._path.mkdir(parents=True, exist_ok=True)
+        p.write_text(json.dumps(total, indent=1))
+        return total
@@ -0,0 +1,95 @@
+from pathlib import Path
+from hashlib import file_digest
+import threading
+import json
+import os
+
+from . import jmake
+from . import trace
+from . import scriptenv
+
+
+def digest(path):
+    with open(path, 'rb') as f:
+        return file_digest(f, 'md5').hexdigest()
+
+
+# list of every file generated in this run, files generated by the previous run but not this one are deleted
+# every build script sharing bin keeps its own manifest and never deletes a file another script generated
+class Manifest:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = set()
+
+    def path(self):
+        host = jmake.Env()
+        name = Path(scriptenv.script() or "manifest").stem
+        return Path(host.bin).absolute() / "jmake" / f"manifest.{name}.json"
+
+    def _read(self, p):
+        if not p.is_file():
+            return []
+        try:
+            return json.loads(p.read_text())
+        except json.JSONDecodeError:
+            return []
+
+    def record(self, path):
+        with self._lock:
+            self._files.add(str(Path(path).absolute()))
+
+    def clean(self):
+        p = self.path()
+        previous = self._read(p)
+        others = set()
+        for other in p.parent.glob("manifest.*.json"):
+            if other != p:
+                others.update(self._read(other))
+        for fname in previous:
+            if fname in self._files or fname in others:
+                continue
+            if Path(fname).is_file():
+                print(f"removing stale output {fname}")
+                Path(fname).unlink()
+        p.parent.mkdir(parents=True, exist_ok=True)
+        write(p, json.dumps(sorted(self._files), indent=1), record=False)
+
+
+manifest = Manifest()
+
+
+# writes go to a temporary file next to path, path is only replaced when the content differs so its mtime survives
+class OutputFile:
+    def __init__(self, path, record=True):
+        self.path = Path(path)
+        self.changed = False
+        self._tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        self._file = None
+        if record:
+            manifest.record(self.path)
+
+    def __enter__(self):
+        self._begin = trace.now()
+        self._file = open(self._tmp, 'w')
+        return self._file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        if exc_type is not None:
+            self._tmp.unlink(missing_ok=True)
+            return False
+        if not self.path.is_file() or digest(self.path) != digest(self._tmp):
+            os.replace(self._tmp, self.path)
+            self.changed = True
+        else:
+            self._tmp.unlink()
+        trace.complete("write " + self.path.name, self._begin, cat="write", args={ "path": str(self.path), "changed": self.changed })
+        return False
+
+
+# returns true if the file was written
+def write(path, data, record=True):
+    out = OutputFile(path, record)
+    with out as f:
+        f.write(data)
+    return out.changed
@@ -0,0 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import subprocess
+import json
+import os
+import re
+
+from . import jmake
+from . import output
+from . import trace
+
+VERSION = 1
+
+
+class Package:
+    def __init__(self, name, url=None, branch=None):
+        host = jmake.Env()
+        self.name = name
+        self.url = url
+        self.branch = branch
+        self.path = Path(host.paths[0]) / host.lib / name
+        self.relpath = f"{host.lib}/{name}"
+        self.resolved = False
+
+
+_declared = {}
+
+
+def declare(name, url=None, branch=None):
+    if name not in _declared:
+        _declared[name] = Package(name, url, branch)
+    return _declared[name]
+
+
+def lockpath():
+    host = jmake.Env()
+    return Path(host.paths[0]) / "jmake.lock"
+
+
+def load_lock():
+    p = lockpath()
+    if not p.is_file():
+        return {}
+    try:
+        data = json.loads(p.read_text())
+    except json.JSONDecodeError:
+        return {}
+    return data.get("packages", {}) if data.get("version") == VERSION else {}
+
+
+# read the checked out commit straight from the git directory so resolved packages never spawn git
+def head(path):
+    git = Path(path) / ".git"
+    if git.is_file():
+        content = git.read_text().strip()
+        if not content.startswith("gitdir:"):
+            return None
+        git = (Path(path) / content[7:].strip()).resolve()
+    if not (git / "HEAD").is_file():
+        return None
+    ref = (git / "HEAD").read_text().strip()
+    if not ref.startswith("ref:"):
+        return ref
+    ref = ref[4:].strip()
+
+    common = git
+    if (git / "commondir").is_file():
+        common = (git / (git / "commondir").read_text().strip()).resolve()
+    for d in [ git, common ]:
+        if (d / ref).is_file():
+            return (d / ref).read_text().strip()
+    for d in [ git, common ]:
+        packed = d / "packed-refs"
+        if packed.is_file():
+            for line in packed.read_text().splitlines():
+                if line.endswith(" " + ref):
+                    return line.split(" ")[0]
+    return None
+
+
+def git(args, cwd=None, url=None):
+    cmd = [ "git" ]
+    # local and bare repositories stand in for remotes, newer git refuses file transport for submodules by default
+    if url and (os.path.isdir(url) or url.startswith("file:")):
+        cmd.extend([ "-c", "protocol.file.allow=always" ])
+    cmd.extend(args)
+    with trace.span("git " + args[0], cat="git", args={ "command": ' '.join(cmd), "cwd": str(cwd) }):
+        res = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+    if res.returncode != 0:
+        print(f"command failed!\n{' '.join(cmd)}\n{res.stdout}{res.stderr}", end='')
+    return res.returncode == 0
+
+
+def registered():
+    host = jmake.Env()
+    p = Path(host.paths[0]) / ".gitmodules"
+    if not p.is_file():
+        return set()
+    return set(re.findall(r'^\s*path\s*=\s*(.+?)\s*$', p.read_text(), re.M))
+
+
+# acquire every declared package in one batch, only missing or unpinned packages touch git
+def resolve(jobs=None):
+    with trace.span("resolve packages", cat="git"):
+        _resolve(jobs)
+
+
+def _resolve(jobs):
+    host = jmake.Env()
+    jobs = jobs or host.vcpu or 1
+    root = str(host.paths[0])
+    pending = [ package for package in _declared.values() if not package.resolved ]
+    if not len(pending):
+        return
+
+    lock = load_lock()
+    missing = [ package for package in pending if package.url and not package.path.exists() ]
+    if len(missing):
+        known = registered()
+        init = [ package for package in missing if package.relpath in known ]
+        if len(init):
+            print(f"initializing packages {', '.join([ package.name for package in init ])}")
+            git([ "submodule", "update", "--init", "--recursive", "--jobs", str(jobs), "--" ]
+                    + [ package.relpath for package in init ], cwd=root, url=init[0].url)
+
+        clone = [ package for package in missing if not package.path.exists() ]
+        def fetch(package):
+            print(f"package {package.name}, url: {package.url} not found! cloning...")
+            cmd = [ "clone", "--recursive" ]
+            if package.branch:
+                cmd.extend([ "-b", package.branch ])
+            return git(cmd + [ package.url, str(package.path) ], url=package.url)
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            cloned = list(pool.map(fetch, clone))
+
+        # registering touches the index of the root repository so it has to be serial
+        added = []
+        for package, ok in zip(clone, cloned):
+            if not ok:
+                continue
+            cmd = [ "submodule", "add" ]
+            if package.branch:
+                cmd.extend([ "-b", package.branch ])
+            if git(cmd + [ package.url, package.relpath ], cwd=root, url=package.url):
+                added.append(package.relpath)
+
+        # move the clones' git directories into the root repository like submodule add does, packages must not have a .git folder
+        if len(added):
+            git([ "submodule", "absorbgitdirs", "--" ] + added, cwd=root)
+
+    def pin(package):
+        entry = lock.get(package.name)
+        if not entry or not entry.get("commit") or not package.path.exists():
+            return
+        if head(package.path) == entry["commit"]:
+            return
+        print(f"package {package.name}, checking out locked commit {entry['commit']}")
+        if not git([ "checkout", "-q", entry["commit"] ], cwd=str(package.path)):
+            git([ "fetch", "-q", "origin" ], cwd=str(package.path), url=package.url)
+            git([ "checkout", "-q", entry["commit"] ], cwd=str(package.path))
+
+    remote = [ package for package in pending if package.url ]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(pin, remote))
+
+    changed = False
+    for package in remote:
+        entry = { "url": package.url, "branch": package.branch, "commit": head(package.path) }
+        if lock.get(package.name) != entry and entry["commit"]:
+            lock[package.name] = entry
+            changed = True
+    for package in pending:
+        package.resolved = True
+
+    if changed:
+        data = { "version": VERSION, "packages": dict(sorted(lock.items())) }
+        output.write(lockpath(), json.dumps(data, indent=1) + "\n", record=False)
@@ -5,8 +5,31 @@ import os.path
 import sys
 
 from . import jmake
+from . import trace
+
+
+# the build script being run, None in an interactive session
+def script():
+    fname = getattr(sys.modules["__main__"], "__file__", None)
+    return os.path.abspath(fname) if fname else None
+
 
 def setupenv(needpath=True):
+    # tracing starts before the chdir so a relative output path is relative to where jmake was started
+    args = []
+    skip = False
+    for i, arg in enumerate(sys.argv[1:]):
+        if skip:
+            skip = False
+        elif arg == "--trace":
+            skip = True
+            if i + 2 < len(sys.argv):
+                trace.start(sys.argv[i + 2])
+        elif arg.startswith("--trace="):
+            trace.start(arg[len("--trace="):])
+        else:
+            args.append(arg)
+
     found = False
     for i in range(32):
         if os.path.exists(".git"):
@@ -19,10 +42,40 @@ def setupenv(needpath=True):
 
     host = jmake.Env()
     if not host.mode:
-        host.mode = 'generate' if len(sys.argv) <= 1 else sys.argv[1]
+        modes = [ arg for arg in args if not arg.startswith('-') ]
+        host.mode = modes[0] if len(modes) else 'generate'
 
     if needpath:
         g = inspect.currentframe().f_back.f_globals
         p = Path(g["__file__"]).absolute()
         host.paths.append(p.parent)
         host.module = p
+        if g.get("__name__") == "__main__":
+            fastpath()
+
+
+# run build and hook subcommands from the workspace snapshot instead of evaluating the build script
+def fastpath():
+    host = jmake.Env()
+    if host.mode not in [ 'prebuild', 'postbuild', 'build' ]:
+        return
+
+    from . import snapshot
+    from . import utils
+    with trace.span("load snapshot"):
+        workspace = snapshot.load()
+    if workspace is None:
+        return
+
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-p', action='append')
+    args, _ = parser.parse_known_args(sys.argv[1:])
+    names = args.p if args.p else workspace._projects.keys()
+    if not all([ name in workspace._projects for name in names ]):
+        return
+    if not snapshot.importable([ workspace[name] for name in names ]):
+        return
+
+    workspace._snapshot = True
+    utils.generate(workspace)
+    sys.exit(0)
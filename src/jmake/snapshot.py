@@ -0,0 +1,204 @@
+from pathlib import Path
+from hashlib import md5
+import importlib
+import json
+import sys
+import os
+
+from . import jmake
+from . import output
+from . import scriptenv
+
+VERSION = 5
+ENV = [ "bin", "lib", "generator", "config", "cache_size", "vs", "pools", "workers", "worker_token", "workers_file", "worker_timeout" ]
+
+
+# every script of a workspace sharing bin keeps its own snapshot
+def path():
+    host = jmake.Env()
+    name = Path(scriptenv.script() or "snapshot").stem
+    return Path(host.bin).absolute() / "jmake" / f"snapshot.{name}.json"
+
+
+# Env as it is before a script changes it, some fields come from environment variables
+def defaults():
+    host = object.__new__(jmake.Env)
+    host.init()
+    return { key: getattr(host, key, None) for key in ENV }
+
+
+# the snapshot is only valid for the environment it was taken in, stored as a hash so no token ends up on disk
+def environment():
+    return md5(bytes(json.dumps(defaults(), sort_keys=True, default=str), 'utf-8')).hexdigest()
+
+
+def stamp(fname):
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return [ st.st_mtime_ns, st.st_size ]
+
+
+# every python file under the root that took part in evaluating the workspace
+def scripts():
+    host = jmake.Env()
+    root = Path(host.paths[0]).absolute()
+    res = set()
+    for module in list(sys.modules.values()):
+        fname = getattr(module, "__file__", None)
+        if fname and fname.endswith(".py") and Path(fname).absolute().is_relative_to(root):
+            res.add(os.path.abspath(fname))
+    return sorted(res)
+
+
+# hooks are stored by reference, functions of the build script itself or local functions cannot be imported
+def hookref(func):
+    name = func.__qualname__
+    importable = func.__module__ != "__main__" and "<locals>" not in name
+    return { "module": func.__module__, "name": name, "importable": importable }
+
+
+def resolve(ref):
+    def hook(project):
+        func = importlib.import_module(ref["module"])
+        for part in ref["name"].split("."):
+            func = getattr(func, part)
+        return func(project)
+    hook.__module__ = ref["module"]
+    hook.__qualname__ = ref["name"]
+    return hook
+
+
+def dump_project(project):
+    deps = []
+    for dependency in project._dependencies:
+        if type(dependency) == jmake.Project:
+            deps.append({ "project": dependency._name })
+        else:
+            deps.append({ "name": dependency })
+    return {
+            "name": project._name,
+            "target": project._target.name,
+            "module": str(project._module),
+            "files": project._files,
+            "modules": project._modules,
+            "defines": project._defines,
+            "dependencies": deps,
+            "include_dirs": project._include_dirs,
+            "library_dirs": project._library_dirs,
+            "compile": project._compile,
+            "link": project._link,
+            "includes": project.includes,
+            "binaries": project.binaries,
+            "libpaths": project.libpaths,
+            "options": project._options,
+            "pch": project._pch,
+            "filters": { config: dump_project(f) for config, f in project._filters.items() },
+            "prebuild": [ hookref(func) for func in project._prebuild ],
+            "postbuild": [ hookref(func) for func in project._postbuild ]
+            }
+
+
+def load_project(data):
+    project = jmake.Project(data["name"], jmake.Target[data["target"]])
+    project._module = data["module"]
+    project.add(data["files"])
+    project._modules = [ (fname, public) for fname, public in data["modules"] ]
+    project._defines = data["defines"]
+    project._include_dirs = data["include_dirs"]
+    project._library_dirs = data["library_dirs"]
+    project._compile = data["compile"]
+    project._link = data["link"]
+    project.includes = data["includes"]
+    project.binaries = data["binaries"]
+    project.libpaths = data["libpaths"]
+    project._options = data["options"]
+    project._pch = data["pch"]
+    project._filters = { config: load_project(f) for config, f in data["filters"].items() }
+    project._prebuild = [ resolve(ref) for ref in data["prebuild"] ]
+    project._postbuild = [ resolve(ref) for ref in data["postbuild"] ]
+    project._hookrefs = data["prebuild"] + data["postbuild"]
+    for f in data["filters"].values():
+        project._hookrefs += f["prebuild"] + f["postbuild"]
+    return project
+
+
+def save(workspace, dirs=[]):
+    host = jmake.Env()
+    projects = {}
+    def visit(project):
+        if project._name in projects:
+            return
+        projects[project._name] = project
+        for dependency in project._dependencies:
+            if type(dependency) == jmake.Project:
+                visit(dependency)
+    for project in workspace._projects.values():
+        visit(project)
+
+    data = {
+            "version": VERSION,
+            "script": scriptenv.script(),
+            "environment": environment(),
+            # only what the script changed, the rest comes from the environment again
+            "env": { key: getattr(host, key) for key, value in defaults().items() if getattr(host, key, None) != value },
+            "scripts": { fname: stamp(fname) for fname in scripts() },
+            "dirs": { str(d): stamp(d) for d in sorted(dirs) },
+            "workspace": {
+                "name": workspace._name,
+                "projects": list(workspace._projects.keys()),
+                "always_build": [ project._name for project in workspace._always_build ],
+                "configs": workspace._configs,
+                "lang": workspace.lang,
+                "libc": workspace.libc
+                },
+            "projects": [ dump_project(project) for project in projects.values() ]
+            }
+    p = path()
+    p.parent.mkdir(parents=True, exist_ok=True)
+    output.write(p, json.dumps(data, default=str), record=False)
+
+
+# returns the snapshotted workspace if no contributing script or globbed directory changed, None otherwise
+def load():
+    p = path()
+    if not p.is_file():
+        return None
+    try:
+        data = json.loads(p.read_text())
+    except json.JSONDecodeError:
+        return None
+    if data.get("version") != VERSION or data.get("script") != scriptenv.script() or data.get("environment") != environment():
+        return None
+    for fname, st in list(data["scripts"].items()) + list(data["dirs"].items()):
+        if stamp(fname) != st:
+            return None
+
+    host = jmake.Env()
+    for key, value in data["env"].items():
+        setattr(host, key, value)
+
+    projects = { d["name"]: load_project(d) for d in data["projects"] }
+    for d in data["projects"]:
+        project = projects[d["name"]]
+        for dependency in d["dependencies"]:
+            project._dependencies.append(projects[dependency["project"]] if "project" in dependency else dependency["name"])
+        project._touch()
+
+    ws = data["workspace"]
+    workspace = jmake.Workspace(ws["name"])
+    workspace._projects = { name: projects[name] for name in ws["projects"] }
+    workspace._always_build = [ projects[name] for name in ws["always_build"] ]
+    workspace._configs = ws["configs"]
+    workspace.lang = ws["lang"]
+    workspace.libc = ws["libc"]
+    return workspace
+
+
+# the snapshot can only run hooks it is able to import
+def importable(projects):
+    for project in projects:
+        if not all([ ref["importable"] for ref in project._hookrefs ]):
+            return False
+    return True
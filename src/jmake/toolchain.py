@@ -0,0 +1,207 @@
+from pathlib import Path
+import hashlib
+
+from . import jmake
+from . import hookserver
+from . import unity
+from . import output
+from . import modscan
+
+
+class GCCToolchain:
+    def __init__(self, workspace):
+        self._workspace = workspace
+        self._lang = {
+                "cpp14": "-std=c++14",
+                "cpp17": "-std=c++17",
+                "cpp20": "-std=c++20",
+                "cpp": "-std=c++2b",
+                "c11": "-std=c11",
+                "c17": "-std=c17"
+                }
+        self._warn = {
+                0: [ "-w" ],
+                1: [],
+                2: [ "-Wall" ],
+                3: [ "-Wall" ],
+                4: [ "-Wall", "-Wextra" ]
+                }
+        self._prefix = {
+                jmake.Target.EXECUTABLE: "",
+                jmake.Target.SHARED_LIBRARY: "lib",
+                jmake.Target.STATIC_LIBRARY: "lib"
+                }
+        self._ext = {
+                jmake.Target.EXECUTABLE: "",
+                jmake.Target.SHARED_LIBRARY: ".so",
+                jmake.Target.STATIC_LIBRARY: ".a"
+                }
+        self.sources = [ ".c", ".cpp", ".cc", ".cxx" ]
+
+    def bindir(self, config):
+        host = jmake.Env()
+        return Path(host.bin).absolute() / config
+
+    def output(self, project, config):
+        name = self._prefix[project._target] + project._name + self._ext[project._target]
+        return self.bindir(config) / name
+
+    def objdir(self, project, config):
+        host = jmake.Env()
+        return Path(host.bin).absolute() / f"{project._name}.dir" / config
+
+    # objects mirror the source tree relative to the root, files outside of it are bucketed by directory hash and
+    # generated sources like unity units sit next to their project's objects
+    def object(self, project, config, fname):
+        host = jmake.Env()
+        p = Path(fname).absolute()
+        root = Path(host.paths[0]) if len(host.paths) else Path.cwd()
+        generated = self.objdir(project, config).parent
+        if p.is_relative_to(generated):
+            rel = p.relative_to(generated)
+        elif p.is_relative_to(root):
+            rel = p.relative_to(root)
+        else:
+            bucket = hashlib.md5(bytes(str(p.parent), 'utf-8')).hexdigest()[:8]
+            rel = Path("_ext") / bucket / p.name
+        return self.objdir(project, config) / (str(rel) + ".o")
+
+    # list of tuple(path, members) of unity translation units
+    def unity(self, project):
+        return unity.split(project, self.sources)[0]
+
+    # list of tuple(fname: str, module: bool) of translation units, unity units replace their members
+    def units(self, project):
+        groups, files = unity.split(project, self.sources)
+        units = [ (str(path), False) for path, members in groups ]
+        units.extend([ (fname, False) for fname in files ])
+        units.extend([ (fname, True) for fname, public in project._modules ])
+        return units
+
+    # dict of unit to tuple(providers, imports), providers are tuple(project, fname) of the module units it has to
+    # wait for and imports is true if it imports any module, dependencies only provide their public modules
+    def module_deps(self, project, options, scanner):
+        units = self.units(project)
+        res = { fname: ([], False) for fname, module in units }
+        dependencies = [ (self._workspace._projects[lib], modules) for lib, modules in options["modules"].items()
+                if lib in self._workspace._projects and len(modules) ]
+        if not len(project._modules) and not len(dependencies):
+            return res
+
+        visible = {}
+        for dep, modules in dependencies:
+            for fname in modules:
+                for name in scanner.provides(fname):
+                    visible[name] = (dep, fname)
+
+        members = { str(path): group for path, group in self.unity(project) }
+        requires = {}
+        for fname, module in units:
+            requires[fname] = [ name for src in members.get(fname, [ fname ]) for name in scanner.requires(src) ]
+            for name in scanner.provides(fname):
+                visible[name] = (project, fname)
+
+        for fname, names in requires.items():
+            res[fname] = ([ visible[name] for name in dict.fromkeys(names) if name in visible and visible[name][1] != fname ], len(names) > 0)
+        modscan.check({ fname: [ provider for dep, provider in providers ] for fname, (providers, imports) in res.items() })
+        return res
+
+    # shell command dropping the module rules gcc writes into depfiles, make and ninja cannot resolve them
+    def strip_modules(self, depfile):
+        return f"sed -E -i -e '/c\\+\\+m|^CXX_IMPORTS|^gcm\\.cache\\//d' -e 's, gcm\\.cache/[^ :]*:,:,' {depfile}"
+
+    def is_cxx(self, fname, module=False):
+        return module or Path(fname).suffix != ".c"
+
+    # wrapper around the project's pch header, gcc picks up the .gch next to it when a unit includes the wrapper
+    def pch(self, project, options, config):
+        if not options["pch"]:
+            return None
+        return self.objdir(project, config) / "pch" / Path(options["pch"]["header"]).name
+
+    def write_pch(self, project):
+        options = project.options(self._workspace._configs)
+        for config in self._workspace._configs:
+            wrapper = self.pch(project, options[config], config)
+            if not wrapper:
+                continue
+            wrapper.parent.mkdir(parents=True, exist_ok=True)
+            header = Path(options[config]["pch"]["header"]).absolute().as_posix()
+            output.write(wrapper, f"#include \"{header}\"\n")
+
+    # flags compiling the wrapper into its .gch, they have to match the flags of the units using it
+    def pch_flags(self, project, options):
+        return self.compile_flags(project, options, "pch.cpp") + [ "-x", "c++-header" ]
+
+    # pch is the wrapper from pch(), only c++ units that are not modules use it
+    def compile_flags(self, project, options, fname, module=False, pch=None):
+        flags = []
+        cxx = self.is_cxx(fname, module)
+        lang = self._workspace.lang
+        if ("cpp" in lang) == cxx and lang in self._lang:
+            flags.append(self._lang[lang])
+        if module:
+            flags.extend([ "-fmodules-ts", "-x", "c++" ])
+
+        optimize = options["optimization"] or not options["debug"]
+        flags.append("-O2" if optimize else "-O0")
+        if options["debug"]:
+            flags.append("-g")
+        if cxx and not options["rtti"]:
+            flags.append("-fno-rtti")
+        flags.extend(self._warn.get(options["warn"], [ "-Wall" ]))
+        if project._target != jmake.Target.EXECUTABLE:
+            flags.append("-fPIC")
+
+        flags.append("-D_DEBUG" if options["debug"] else "-DNDEBUG")
+        for define, value in options["defines"].items():
+            tmp = define
+            if value:
+                value = "\"" + value + "\"" if type(value) == str else str(value)
+                tmp = define + "=" + value
+            flags.append("-D" + tmp)
+
+        flags.extend([ "-I" + str(Path(dir).absolute()) for dir in options["includes"] ])
+        flags.extend(options["compile"])
+        if pch and cxx and not module:
+            flags.extend([ "-include", str(pch) ])
+        return flags
+
+    # outputs of workspace projects this project links against
+    def link_inputs(self, project, options, config):
+        inputs = []
+        for dependency in options["depends"]:
+            if dependency not in self._workspace._projects:
+                continue
+            dep = self._workspace._projects[dependency]
+            if jmake.valid_dependency_project(dep):
+                inputs.append(self.output(dep, config))
+        return inputs
+
+    def link_flags(self, project, options, config):
+        flags = [ "-L" + str(Path(path).absolute()) for path in options["libpaths"] ]
+        if project._target == jmake.Target.SHARED_LIBRARY:
+            flags.append("-shared")
+        flags.append("-Wl,-rpath,$ORIGIN")
+        if options["debug"]:
+            flags.append("-g")
+
+        inputs = [ str(path) for path in self.link_inputs(project, options, config) ]
+        if len(inputs):
+            flags.extend([ "-Wl,--start-group" ] + inputs + [ "-Wl,--end-group" ])
+        for dependency in options["depends"]:
+            if dependency in self._workspace._projects:
+                continue
+            flags.append("-l" + dependency)
+        flags.extend(options["link"])
+        return flags
+
+    def linker(self, project):
+        cxx = any([ self.is_cxx(fname, module) for fname, module in self.units(project) ])
+        return "cxx" if cxx else "cc"
+
+    def hook(self, project, config, event):
+        return hookserver.hook_command(self._workspace, project, config, event)
+
+    def has_hooks(self, project, config, event):
+        return len(project.hooks(config, event)) > 0
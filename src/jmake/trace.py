@@ -0,0 +1,95 @@
+from pathlib import Path
+import contextlib
+import threading
+import atexit
+import json
+import time
+import os
+
+# chrome trace format (chrome://tracing, perfetto), spans are only recorded after start()
+enabled = False
+_path = None
+_origin = 0
+_events = []
+_threads = {}
+_lock = threading.Lock()
+
+
+def start(path):
+    global enabled, _path, _origin
+    if enabled:
+        return
+    enabled = True
+    _path = Path(path).absolute()
+    _origin = time.perf_counter_ns()
+    _tid() # the starting thread is the main thread
+    atexit.register(save)
+
+
+def now():
+    return time.perf_counter_ns()
+
+
+def _tid():
+    ident = threading.get_ident()
+    tid = _threads.get(ident)
+    if tid is None:
+        with _lock:
+            tid = _threads.setdefault(ident, len(_threads) + 1)
+    return tid
+
+
+# records a finished span, begin and end are perf_counter_ns values
+def complete(name, begin, end=None, cat="jmake", args=None):
+    if not enabled:
+        return
+    end = now() if end is None else end
+    event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": (begin - _origin) / 1000,
+            "dur": (end - begin) / 1000,
+            "pid": os.getpid(),
+            "tid": _tid()
+            }
+    if args:
+        event["args"] = args
+    with _lock:
+        _events.append(event)
+
+
+class _Span:
+    def __init__(self, name, cat, args):
+        self._name = name
+        self._cat = cat
+        self._args = args
+        self._begin = 0
+
+    def __enter__(self):
+        self._begin = now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        complete(self._name, self._begin, cat=self._cat, args=self._args)
+        return False
+
+
+_disabled = contextlib.nullcontext()
+
+
+def span(name, cat="jmake", args=None):
+    if not enabled:
+        return _disabled
+    return _Span(name, cat, args)
+
+
+def save():
+    if not enabled:
+        return
+    with _lock:
+        events = list(_events)
+    names = [ { "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": { "name": "main" if tid == 1 else f"worker {tid - 1}" } }
+            for tid in sorted(_threads.values()) ]
+    _path.parent.mkdir(parents=True, exist_ok=True)
+    _path.write_text(json.dumps({ "traceEvents": names + events, "displayTimeUnit": "ms" }))
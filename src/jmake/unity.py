@@ -0,0 +1,73 @@
+from pathlib import Path
+import fnmatch
+
+from . import jmake
+from . import output
+
+
+def unitdir(project):
+    host = jmake.Env()
+    return Path(host.bin).absolute() / f"{project._name}.dir" / "unity"
+
+
+def excluded(fname, patterns):
+    name = Path(fname).name
+    path = Path(fname).absolute().as_posix()
+    return any([ fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern) for pattern in patterns ])
+
+
+# sources named by the project's or a filter's pch, msvc creates the pch from them so they never join a unit
+def pch_sources(project):
+    res = set()
+    for p in [ project ] + list(project._filters.values()):
+        if p._pch and p._pch["header"] and p._pch["source"]:
+            res.add(Path(p._pch["source"]).absolute())
+    return res
+
+
+# returns tuple(units, files), units is a list of tuple(path, members) grouping about project["unity"] sources
+# each, files are the sources compiled on their own, c and c++ sources never share a unit
+def split(project, sources):
+    key = (jmake.Project._generation, tuple(sources))
+    if project._unity is None or project._unity[0:2] != key:
+        project._unity = key + (_split(project, sources),)
+    return project._unity[2]
+
+
+def _split(project, sources):
+    size = project["unity"]
+    files = [ fname for fname in project._files if Path(fname).suffix in sources ]
+    if not size or size < 2:
+        return ([], files)
+
+    patterns = project["unity_exclude"]
+    if type(patterns) != list:
+        patterns = [ patterns ]
+    pchs = pch_sources(project)
+    loose_set = { fname for fname in files if excluded(fname, patterns) or Path(fname).absolute() in pchs }
+    units = []
+    # c and c++ units get distinct stems, msvc names objects after the stem only
+    for stem, ext, lang in [ ("unity_c", ".c", [ ".c" ]), ("unity", ".cpp", [ s for s in sources if s != ".c" ]) ]:
+        members = [ fname for fname in files if Path(fname).suffix in lang and fname not in loose_set ]
+        if len(members) < 2:
+            loose_set.update(members)
+            continue
+        # spread the sources evenly so no unit ends up with a lone leftover file
+        count = -(-len(members) // size)
+        for i in range(count):
+            group = members[i * len(members) // count:(i + 1) * len(members) // count]
+            units.append((unitdir(project) / f"{stem}_{i}{ext}", group))
+
+    loose = [ fname for fname in files if fname in loose_set ]
+    return (units, loose)
+
+
+def source(members):
+    return ''.join([ f"#include \"{Path(fname).absolute().as_posix()}\"\n" for fname in members ])
+
+
+# unit files only change on disk when their membership changes
+def write(units):
+    for path, members in units:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        output.write(path, source(members))
@@ -1,24 +1,38 @@
-from pathlib import Path
 import argparse
 import importlib
-import subprocess
-import hashlib
-import re
+import sys
 from . import jmake
 from . import generator
+from . import builder
+from . import dirindex
+from . import output
+from . import hookserver
+from . import snapshot
 from . import scriptenv
+from . import packages
+from . import configure
+from . import trace
+from . import watch
 
 
-def glob(dname, expr):
+# one directory index is shared by every glob in a run and persisted by generate()
+_dirindex = dirindex.DirIndex()
+_configure = configure.Configure()
+_globs = [] # tuple(base, patterns, exclude, files) of every glob, watch runs them again when their directories change
+
+
+# returns sorted absolute paths, exclude takes patterns in the same syntax as expr
+def glob(dname, expr, exclude=[]):
     if type(expr) != list:
         expr = [ expr ]
+    if type(exclude) != list:
+        exclude = [ exclude ]
     host = jmake.Env()
     p = host.paths[-1] / dname
-
-    res = []
-    for e in expr:
-        res.extend([ str(path.absolute()) for path in p.glob(e) ])
-    return res
+    with trace.span("glob " + str(dname), cat="glob", args={ "patterns": expr }):
+        files = _dirindex.glob(p, expr, exclude)
+    _globs.append((p, expr, exclude, files))
+    return list(files)
 
 
 # return a path expansion relative to the calling source file
@@ -37,101 +51,57 @@ def rootpath(dname):
     return [ str(host.paths[0] / path) for path in dname ]
 
 
+# declare a package without importing it, every declared package is acquired in one batch on the first package() call
+def declare_package(name, url=None, branch=None):
+    packages.declare(name, url, branch)
+
+
+# acquire all declared packages in parallel, jobs defaults to the number of cpus
+def resolve_packages(jobs=None):
+    packages.resolve(jobs)
+
+
 # note: local packages must have an empty .git file/folder so setupenv works correctly
 def package(name, url=None, branch=None):
     host = jmake.Env()
-    path = Path(rootpath(host.lib)[0]) / name
-    if url:
-        if not path.exists():
-            cmd = [ "git", "submodule", "update", "--init", "--recursive" ]
-            print(f"package {name}, url: {url} not found! doing git submodule update...")
-            res = subprocess.run(cmd)
-            if res.returncode != 0:
-                print(f"command failed!\n{' '.join(cmd)}")
-        if not path.exists():
-            cmd = [ "git", "submodule", "add" ]
-            if branch:
-                cmd.extend([ "-b", branch ])
-
-            relpath = str(path).removeprefix(str(host.paths[0]))[1:]
-            cmd.extend([ url, relpath ])
-            print(f"package {name}, url: {url} not found! doing git submodule add...")
-            res = subprocess.run(cmd)
-            if res.returncode != 0:
-                print(f"command failed!\n{' '.join(cmd)}")
-    else:
-        if not path.exists():
+    pkg = packages.declare(name, url, branch)
+    packages.resolve()
+    if not pkg.path.exists():
+        if url:
+            print(f"error, package '{name}' could not be acquired from {url}")
+        else:
             print(f"error, local package '{name}' specified but not found")
-            return None
+        return None
 
     path = f"{host.lib}.{name}.{name}"
 
     size = len(host.paths)
-    m = importlib.import_module(path)
+    with trace.span("package " + name, cat="script"):
+        m = importlib.import_module(path)
     if len(host.paths) > size:
         host.paths.pop() # cleanup paths
 
     return m.workspace
 
 
-# added for cmake compatibility
+# added for cmake compatibility, the output is written right away so the rest of the script can use it
 def configure_file(fname_in, fname_out, opts={}):
     host = jmake.Env()
-    if host.mode != 'generate':
+    if host.mode not in [ 'generate', 'build', 'watch' ]:
         return
-
-    lines = []
-    with open(fname_in) as f:
-        lines = f.readlines()
-
-    p = re.compile('@(\w+)@')
-    for i, line in enumerate(lines):
-        if not '#cmakedefine' in line:
-            matches = p.findall(line)
-            for m in matches:
-                if m not in opts:
-                    print(f"possible error on line {i}, {m} not found in opts\n{lines[i]}")
-                    continue
-                line = line.replace(f"@{m}@", str(opts[m]))
-            lines[i] = line
-            continue
-
-        tokens = line.expandtabs(1).split(' ')
-        varname = ''
-        for token in tokens:
-            if token == '': continue
-            valid = True
-            for discard in ['#cmakedefine']:
-                if discard in token:
-                    valid = False
-                    break
-            if not valid: continue
-            varname = token
-            break
-        if varname == '':
-            print(f"possible error on line {i}, variable name not found\n{line}")
-            continue
-        lines[i] = f"#define {varname} {opts[varname]}" if varname in opts else ''
-
-    data = ''.join(lines)
-    p = Path(fname_out)
-    if p.is_file():
-        # we cannot use file_digest due to encoding differences on windows
-        with open(p, 'r') as f:
-            compare = hashlib.md5(bytes(f.read(), 'utf-8'))
-        digest = hashlib.md5(bytes(data, 'utf-8'))
-        if digest.hexdigest() == compare.hexdigest():
-            return
-
-    with open(p, 'w') as f:
-        count = f.write(data)
-        print(f"configured {fname_in}, wrote {count} bytes to {fname_out}")
+    _configure.add(fname_in, fname_out, opts)
 
 def _build(workspace, args):
     host = jmake.Env()
-    gitfolder = host.paths[-1] / ".git"
-    if not gitfolder.is_dir():
-        return
+    if args.c:
+        host.config = args.c
+    print(f"building {workspace._name} config={host.config}")
+
+    projects = [ workspace[name] for name in args.p ] if args.p else None
+    build = builder.Builder(workspace, host.config, args.j)
+    build.plan(projects)
+    if not build.run():
+        sys.exit(1)
 
 
 def _generate(workspace, args):
@@ -139,7 +109,9 @@ def _generate(workspace, args):
     print("generating make files for " + host.generator)
 
     gen = generator.factory(host.generator)
+    gen.jobs = getattr(args, 'j', None)
     gen.generate(workspace)
+    output.manifest.clean()
 
 
 def _prebuild_events(workspace, args):
@@ -158,33 +130,90 @@ def _postbuild_events(workspace, args):
     workspace[args.p].postbuild(args.c)
 
 
+def _hooks(workspace, args):
+    scriptenv.setupenv(False)
+    server = hookserver.HookServer(workspace)
+    server.serve(args.idle)
+
+
+def _watch(workspace, args):
+    host = jmake.Env()
+    if args.c:
+        host.config = args.c
+    watcher = watch.Watcher(workspace, _globs, _configure, args)
+    watcher.run()
+
+
 def generate(workspace, parser=None, subparser=None):
     host = jmake.Env()
     gitfolder = host.paths[-1] / ".git"
     if not gitfolder.is_dir():
         return
 
+    # the script was evaluated from the moment tracing started until now
+    trace.complete("evaluate " + workspace._name, trace._origin, cat="script")
+
+    # parsed by setupenv already, accepted here so every subcommand takes it
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--trace', metavar='out.json', help='write a chrome trace of this run')
+
     if not parser:
-        parser = argparse.ArgumentParser(description='build script')
+        parser = argparse.ArgumentParser(description='build script', parents=[ common ])
         subparser = parser.add_subparsers()
     parser.set_defaults(func=_generate)
 
-    build_parser = subparser.add_parser('build')
+    build_parser = subparser.add_parser('build', parents=[ common ])
+    build_parser.add_argument('-c')
+    build_parser.add_argument('-j', type=int)
+    build_parser.add_argument('-p', action='append')
     build_parser.set_defaults(func=_build)
 
-    gen_parser = subparser.add_parser('generate')
+    gen_parser = subparser.add_parser('generate', parents=[ common ])
+    gen_parser.add_argument('-j', type=int)
     gen_parser.set_defaults(func=_generate)
 
-    pre_parser = subparser.add_parser('prebuild')
+    pre_parser = subparser.add_parser('prebuild', parents=[ common ])
     pre_parser.add_argument('-c')
     pre_parser.add_argument('-p')
     pre_parser.set_defaults(func=_prebuild_events)
 
-    post_parser = subparser.add_parser('postbuild')
+    post_parser = subparser.add_parser('postbuild', parents=[ common ])
     post_parser.add_argument('-c')
     post_parser.add_argument('-p')
     post_parser.set_defaults(func=_postbuild_events)
 
+    hook_parser = subparser.add_parser('hooks', parents=[ common ])
+    hook_parser.add_argument('--idle', type=float)
+    hook_parser.set_defaults(func=_hooks)
+
+    watch_parser = subparser.add_parser('watch', parents=[ common ])
+    watch_parser.add_argument('-c')
+    watch_parser.add_argument('-j', type=int)
+    watch_parser.add_argument('--build', action='store_true', help='build after every change')
+    watch_parser.add_argument('--no-generate', dest='generate', action='store_false', help='do not emit project files')
+    watch_parser.set_defaults(func=_watch)
+
     args = parser.parse_args()
-    args.func(workspace, args)
+    try:
+        with trace.span("graph"):
+            workspace.graph()
+    except jmake.DependencyCycle as e:
+        print(f"error, {e}")
+        sys.exit(1)
+    _dirindex.save()
+    if not getattr(workspace, '_snapshot', False):
+        with trace.span("save snapshot"):
+            snapshot.save(workspace, _dirindex.checked())
+    elif host.mode == 'build':
+        _configure.replay()
+    if host.mode in [ 'generate', 'build', 'watch' ]:
+        with trace.span("configure"):
+            _configure.run()
+    # module imports are only known once the sources are scanned
+    try:
+        with trace.span(host.mode):
+            args.func(workspace, args)
+    except jmake.DependencyCycle as e:
+        print(f"error, {e}")
+        sys.exit(1)
 
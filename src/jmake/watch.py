@@ -0,0 +1,277 @@
+from pathlib import Path
+import ctypes.util
+import ctypes
+import struct
+import select
+import time
+import sys
+import os
+
+from . import jmake
+from . import generator
+from . import builder
+from . import dirindex
+from . import output
+from . import snapshot
+from . import trace
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_LISTING = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+IN_MASK = IN_CLOSE_WRITE | IN_LISTING
+
+# jmake is imported before setupenv changes to the root, a relative script path is only valid now
+_script = Path(sys.argv[0]).absolute()
+
+
+# watches directories, wait() returns a list of tuple(directory, name, listing) where listing is true if the entry
+# was created, deleted or moved and false if it was written, directory None means events were lost
+class Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}
+        self._wds = {}
+
+    def add(self, path):
+        path = str(path)
+        if path in self._wds:
+            return
+        wd = self._add(self._fd, os.fsencode(path), IN_MASK)
+        if wd >= 0:
+            self._dirs[wd] = path
+            self._wds[path] = wd
+
+    def wait(self, timeout=None):
+        readable, _, _ = select.select([ self._fd ], [], [], timeout)
+        if not len(readable):
+            return []
+        try:
+            data = os.read(self._fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        events = []
+        i = 0
+        while i + 16 <= len(data):
+            wd, mask, cookie, size = struct.unpack_from("iIII", data, i)
+            name = data[i + 16:i + 16 + size].rstrip(b"\0").decode(errors="replace")
+            i += 16 + size
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, "", True))
+                continue
+            path = self._dirs.get(wd)
+            if path is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # the kernel drops the watch, a directory created again under the same name is watched anew
+                del self._wds[self._dirs.pop(wd)]
+            events.append((path, name, bool(mask & IN_LISTING)))
+        return events
+
+
+# fallback where inotify is not available, only notices entries created or deleted and files of interest written
+class Poller:
+    def __init__(self, files=[], interval=0.5):
+        self._dirs = {}
+        self._files = { str(fname): self._stamp(fname) for fname in files }
+        self._interval = interval
+
+    def _stamp(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def add(self, path):
+        path = str(path)
+        if path not in self._dirs:
+            self._dirs[path] = self._stamp(path)
+
+    def wait(self, timeout=None):
+        time.sleep(self._interval if timeout is None else min(timeout, self._interval))
+        events = []
+        for path, stamp in self._dirs.items():
+            st = self._stamp(path)
+            if st != stamp:
+                self._dirs[path] = st
+                events.append((path, "", True))
+        for fname, stamp in self._files.items():
+            st = self._stamp(fname)
+            if st != stamp:
+                self._files[fname] = st
+                events.append((str(Path(fname).parent), Path(fname).name, False))
+        return events
+
+
+# keeps the evaluated workspace in memory and redoes only the work a change affects, a changed glob directory is
+# globbed again and only projects whose files changed are emitted again, a changed template only configures its outputs
+# build scripts cannot be evaluated incrementally, the process restarts itself when one changes
+class Watcher:
+    def __init__(self, workspace, globs, configure, args):
+        self._workspace = workspace
+        self._globs = globs # list of tuple(base, patterns, exclude, files) of every glob() call
+        self._configure = configure
+        self._args = args
+        self._index = dirindex.DirIndex()
+        self._dirs = {} # watched directory -> indices into globs
+        self._bin = str(Path(jmake.Env().bin).absolute())
+
+        scripts = { Path(sys.modules["__main__"].__file__).absolute() }
+        scripts |= { Path(project._module) for project in workspace._projects.values() if project._module }
+        self._scripts = { str(p) for p in scripts if p.is_file() }
+        self._templates = set(configure.templates())
+
+        files = self._scripts | self._templates
+        try:
+            if not sys.platform.startswith('linux'):
+                raise OSError("inotify is linux only")
+            self._notify = Inotify()
+        except (OSError, AttributeError, TypeError):
+            self._notify = Poller(files)
+        for fname in files:
+            self._notify.add(Path(fname).parent)
+        for i in range(len(globs)):
+            self._watch(i)
+
+    # directories a glob looks at, new subdirectories are picked up when the glob runs again
+    def _watch(self, i):
+        base, patterns, exclude, files = self._globs[i]
+        roots = {}
+        for pattern in patterns:
+            root, pattern = dirindex.rebase(base, pattern)
+            roots.setdefault(root, []).append(dirindex.depth(pattern))
+        for root, levels in roots.items():
+            maxdepth = None if None in levels else max(levels + [ 0 ])
+            for rel, isdir in self._index.walk(root, maxdepth):
+                if not isdir:
+                    continue
+                path = os.path.normpath(Path(root, rel).absolute())
+                # the build writes to bin, watching it would trigger the build again
+                if path == self._bin or path.startswith(self._bin + os.sep) or ".git" in Path(rel).parts:
+                    continue
+                self._dirs.setdefault(path, set()).add(i)
+                self._notify.add(path)
+
+    # returns the projects whose files changed, None if a change cannot be applied without evaluating the scripts
+    def _reglob(self, indices):
+        self._index = dirindex.DirIndex()
+        dirty = set()
+        for i in sorted(indices):
+            base, patterns, exclude, old = self._globs[i]
+            with trace.span("glob " + str(base), cat="glob", args={ "patterns": patterns }):
+                new = self._index.glob(base, patterns, exclude)
+            if new == old:
+                continue
+            previous = set(old)
+            projects = [ project for project in self._workspace._projects.values() if previous & project._fileset ]
+            if not len(projects):
+                return None
+            for project in projects:
+                self._replace(project, previous, new)
+                dirty.add(project._name)
+            self._globs[i] = (base, patterns, exclude, new)
+            self._watch(i)
+        self._index.save()
+        return dirty
+
+    # the new glob result takes the place of the old one in the project's file list
+    def _replace(self, project, previous, new):
+        files = []
+        inserted = False
+        for fname in project._files:
+            if fname not in previous:
+                files.append(fname)
+            elif not inserted:
+                files.extend(new)
+                inserted = True
+        project._files = list(dict.fromkeys(files))
+        project._fileset = set(project._files)
+        project._touch()
+
+    def generate(self, first=False):
+        host = jmake.Env()
+        gen = generator.factory(host.generator)
+        gen.jobs = getattr(self._args, 'j', None)
+        gen.force = first
+        with trace.span("generate"):
+            gen.generate(self._workspace)
+        output.manifest.clean()
+
+    def build(self):
+        host = jmake.Env()
+        build = builder.Builder(self._workspace, host.config, self._args.j)
+        build.plan()
+        build.run()
+
+    def restart(self):
+        print("build scripts changed, restarting...", flush=True)
+        trace.save()
+        os.execv(sys.executable, [ sys.executable, str(_script) ] + sys.argv[1:])
+
+    # waits for the first event, then collects events until the tree is quiet for a moment
+    def events(self):
+        events = self._notify.wait()
+        while True:
+            more = self._notify.wait(0.1)
+            if not len(more):
+                break
+            events.extend(more)
+        return events
+
+    def step(self, events):
+        globs = set()
+        templates = set()
+        written = False
+        for path, name, listing in events:
+            if path is None:
+                globs |= set(range(len(self._globs)))
+                continue
+            fname = str(Path(path, name))
+            if fname in self._scripts:
+                self.restart()
+            if fname in self._templates:
+                templates.add(fname)
+            elif listing and path in self._dirs:
+                globs |= self._dirs[path]
+            elif not listing and path in self._dirs:
+                written = True
+
+        if len(templates):
+            self._configure.rerun(templates)
+        regenerate = False
+        if len(globs):
+            dirty = self._reglob(globs)
+            if dirty is None:
+                self.restart()
+            if len(dirty):
+                print(f"files of {', '.join(sorted(dirty))} changed")
+                snapshot.save(self._workspace, list(self._dirs.keys()))
+                regenerate = True
+        if regenerate and self._args.generate:
+            self.generate()
+        if self._args.build and (regenerate or written or len(templates)):
+            self.build()
+
+    def run(self):
+        if self._args.generate:
+            self.generate(True)
+        if self._args.build:
+            self.build()
+        print(f"watching {len(self._dirs)} directories, {len(self._scripts)} build scripts and {len(self._templates)} templates")
+        try:
+            while True:
+                events = self.events()
+                if len(events):
+                    self.step(events)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,320 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import socketserver
+import subprocess
+import threading
+import tempfile
+import ipaddress
+import argparse
+import socket
+import shutil
+import json
+import zlib
+import os
+
+from . import jmake
+
+PROTOCOL = 1
+PORT = 3633
+TOOLS = [ "cc", "c++", "gcc", "g++", "clang", "clang++" ]
+
+# flags only the preprocessor reads, units are preprocessed locally so workers never need the sources or headers
+_preprocessor = [ "-I", "-D", "-U", "-include", "-imacros", "-isystem", "-iquote", "-idirafter", "-MF", "-MT", "-MQ" ]
+_depfile = [ "-MMD", "-MD", "-MP", "-M", "-MM" ]
+# workers only run flags that change code generation or diagnostics, anything else could read or write files on them
+_allowed = [ "-w", "-pthread", "-pedantic", "-pedantic-errors", "-ansi" ]
+_allowed_prefixes = [ "-O", "-g", "-W", "-std=", "-m", "-D", "-U" ]
+_denied_prefixes = [ "-Wl,", "-Wa,", "-Wp,", "-mrecord", "-gsplit-dwarf" ]
+_allowed_f = [ "pic", "PIC", "pie", "PIE", "rtti", "exceptions", "omit-frame-pointer", "strict-aliasing", "common",
+        "data-sections", "function-sections", "plt", "inline", "inline-functions", "unroll-loops", "fast-math",
+        "math-errno", "openmp", "lto", "permissive", "builtin", "short-enums", "signed-char", "unsigned-char",
+        "wrapv", "threadsafe-statics", "char8_t", "coroutines", "concepts", "asynchronous-unwind-tables",
+        "unwind-tables", "semantic-interposition", "strict-overflow", "trapv", "tree-vectorize", "finite-math-only" ]
+_allowed_f_prefixes = [ "visibility=", "visibility-inlines-hidden", "stack-protector", "sanitize=", "diagnostics-color",
+        "cf-protection", "stack-clash-protection", "lto=", "template-depth=", "constexpr-depth=", "max-errors=" ]
+
+
+def allowed(flag):
+    if flag in _allowed:
+        return True
+    if any([ flag.startswith(prefix) for prefix in _denied_prefixes ]):
+        return False
+    if flag.startswith("-f"):
+        name = flag[2:]
+        if name.startswith("no-"):
+            name = name[3:]
+        return name in _allowed_f or any([ name.startswith(prefix) for prefix in _allowed_f_prefixes ])
+    return any([ flag.startswith(prefix) for prefix in _allowed_prefixes ])
+
+
+def loopback(bind):
+    if bind == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(bind).is_loopback
+    except ValueError:
+        return False
+
+
+def remote_flags(flags):
+    res = []
+    skip = False
+    for flag in flags:
+        if skip:
+            skip = False
+            continue
+        if flag in _depfile:
+            continue
+        if flag in _preprocessor:
+            skip = True
+            continue
+        if any([ flag.startswith(prefix) for prefix in _preprocessor if len(prefix) == 2 ]):
+            continue
+        res.append(flag)
+    return res
+
+
+def version(tool):
+    exe = shutil.which(tool)
+    if not exe:
+        return None
+    res = subprocess.run([ exe, "--version" ], capture_output=True, text=True)
+    return res.stdout.split("\n")[0] if res.returncode == 0 else None
+
+
+# messages are a json header line followed by a zlib compressed payload of header["size"] bytes
+def send(f, header, data=b""):
+    data = zlib.compress(data, 1) if data else b""
+    f.write(bytes(json.dumps(header | { "size": len(data) }) + "\n", 'utf-8') + data)
+    f.flush()
+
+
+def receive(f):
+    line = f.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    header = json.loads(line)
+    data = f.read(header["size"])
+    if len(data) != header["size"]:
+        raise ConnectionError("connection closed mid message")
+    return (header, zlib.decompress(data) if data else b"")
+
+
+# compiles preprocessed units sent by builders, jobs limits the compilers running at once
+class Worker:
+    def __init__(self, jobs=None, token=None, tools=None):
+        host = jmake.Env()
+        self.jobs = jobs or host.vcpu or 1
+        self._token = token
+        self._tools = tools or TOOLS
+        self._versions = { tool: version(tool) for tool in self._tools }
+        self._slots = threading.Semaphore(self.jobs)
+
+    def handle(self, header, data):
+        if header.get("protocol") != PROTOCOL:
+            return ({ "status": "error", "output": f"protocol {header.get('protocol')} not supported\n" }, b"")
+        if self._token and header.get("token") != self._token:
+            return ({ "status": "error", "output": "invalid token\n" }, b"")
+        if header["op"] == "info":
+            return ({ "status": "ok", "jobs": self.jobs, "versions": self._versions }, b"")
+
+        tool = header["tool"]
+        flags = header["flags"]
+        if not self._versions.get(tool):
+            return ({ "status": "unavailable", "output": f"{tool} not available\n" }, b"")
+        denied = [ flag for flag in flags if type(flag) != str or not allowed(flag) ]
+        if len(denied):
+            return ({ "status": "rejected", "output": f"flags not allowed: {' '.join(map(str, denied))}\n" }, b"")
+
+        with self._slots, tempfile.TemporaryDirectory(prefix="jmake-") as tmp:
+            # the extension tells the compiler the unit is already preprocessed
+            name = Path(header["name"]).stem
+            src = Path(tmp) / (name + (".ii" if header["cxx"] else ".i"))
+            obj = Path(tmp) / (name + ".o")
+            src.write_bytes(data)
+            cmd = [ shutil.which(tool) ] + flags + [ f"-fdebug-prefix-map={tmp}={header['cwd']}", "-c", "-o", str(obj), str(src) ]
+            res = subprocess.run(cmd, capture_output=True, text=True, cwd=tmp)
+            out = (res.stdout + res.stderr).replace(str(src), header["name"])
+            if res.returncode != 0 or not obj.is_file():
+                return ({ "status": "ok", "code": res.returncode or 1, "output": out }, b"")
+            return ({ "status": "ok", "code": 0, "output": out }, obj.read_bytes())
+
+    def serve(self, bind="127.0.0.1", port=PORT):
+        if not loopback(bind) and not self._token:
+            raise ValueError(f"a token is required to listen on {bind}")
+        worker = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    header, data = receive(self.rfile)
+                    response, out = worker.handle(header, data)
+                except (OSError, ValueError, KeyError) as e:
+                    response, out = ({ "status": "error", "output": f"{e}\n" }, b"")
+                try:
+                    send(self.wfile, response, out)
+                except OSError:
+                    pass
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        with Server((bind, port), Handler) as tcp:
+            print(f"jmake worker listening on {bind}:{tcp.server_address[1]}, {self.jobs} jobs")
+            try:
+                tcp.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+
+def configured():
+    host = jmake.Env()
+    if len(host.workers):
+        return (host.workers, host.worker_token)
+    p = Path(host.workers_file).expanduser()
+    if not p.is_file():
+        return ([], None)
+    try:
+        data = json.loads(p.read_text())
+    except json.JSONDecodeError:
+        print(f"warning, {p} is not valid json, building locally")
+        return ([], None)
+    return (data.get("workers", []), data.get("token"))
+
+
+# sends compiles to the least loaded worker, a worker that fails or times out is dropped for the rest of the build and
+# the unit goes to the next one, compile() returns None when no worker can take it so the caller compiles locally
+class WorkerPool:
+    def __init__(self, addresses, token=None):
+        self._token = token
+        self._workers = {}
+        self._busy = {}
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._timeout = jmake.Env().worker_timeout
+        self.stats = { "remote": 0, "failures": 0 }
+
+        def probe(address):
+            try:
+                header, _ = self._request(address, { "op": "info" })
+            except (OSError, ValueError, KeyError) as e:
+                print(f"warning, worker {address} unreachable: {e}")
+                return None
+            if header.get("status") != "ok":
+                print(f"warning, worker {address}: {header.get('output', '').strip()}")
+                return None
+            return header
+
+        addresses = list(dict.fromkeys(addresses))
+        with ThreadPoolExecutor(max_workers=max(len(addresses), 1)) as pool:
+            infos = list(pool.map(probe, addresses))
+        for address, info in zip(addresses, infos):
+            if info:
+                self._workers[address] = info
+                self._busy[address] = 0
+
+    @staticmethod
+    def create():
+        addresses, token = configured()
+        if not len(addresses):
+            return None
+        pool = WorkerPool(addresses, token)
+        return pool if pool.slots() else None
+
+    def slots(self):
+        with self._lock:
+            return sum([ info["jobs"] for info in self._workers.values() ])
+
+    def _address(self, address):
+        host, _, port = address.rpartition(":")
+        return (host or address, int(port) if port.isdigit() and host else PORT)
+
+    def _request(self, address, header, data=b"", timeout=None):
+        header = header | { "protocol": PROTOCOL, "token": self._token }
+        with socket.create_connection(self._address(address), timeout=2) as s:
+            s.settimeout(timeout)
+            with s.makefile('rwb') as f:
+                send(f, header, data)
+                return receive(f)
+
+    def _version(self, tool):
+        with self._lock:
+            if tool in self._versions:
+                return self._versions[tool]
+        v = version(tool)
+        with self._lock:
+            self._versions[tool] = v
+        return v
+
+    # workers with the same compiler and a free job, least loaded first
+    def _pick(self, tool, v):
+        with self._lock:
+            free = [ address for address, info in self._workers.items()
+                    if info["versions"].get(tool) == v and self._busy[address] < info["jobs"] ]
+            if not len(free):
+                return None
+            address = min(free, key=lambda a: self._busy[a] / self._workers[a]["jobs"])
+            self._busy[address] += 1
+            return address
+
+    def _drop(self, address, reason):
+        with self._lock:
+            if address in self._workers:
+                del self._workers[address]
+                self.stats["failures"] += 1
+                print(f"warning, worker {address} failed ({reason}), dropping it")
+
+    def compile(self, tool, flags, preprocessed, name, cxx, obj):
+        tool = Path(tool).name
+        v = self._version(tool)
+        flags = remote_flags(flags)
+        # workers refuse flags outside the allowlist, such units always compile locally
+        if not v or not all([ allowed(flag) for flag in flags ]):
+            return None
+        header = {
+                "op": "compile",
+                "tool": tool,
+                "flags": flags,
+                "name": name,
+                "cxx": cxx,
+                "cwd": os.getcwd()
+                }
+        while True:
+            address = self._pick(tool, v)
+            if address is None:
+                return None
+            try:
+                res, data = self._request(address, header, preprocessed, self._timeout)
+            except (OSError, ValueError, KeyError) as e:
+                self._drop(address, e)
+                continue
+            finally:
+                with self._lock:
+                    self._busy[address] -= 1
+            # a unit a healthy worker refuses compiles locally, only broken workers are dropped
+            if res.get("status") in [ "rejected", "unavailable" ]:
+                return None
+            if res.get("status") != "ok":
+                self._drop(address, res.get("output", "").strip())
+                continue
+            if res["code"] == 0:
+                Path(obj).write_bytes(data)
+            with self._lock:
+                self.stats["remote"] += 1
+            return (res["code"], res["output"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="jmake", description="jmake tools")
+    subparser = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subparser.add_parser("worker", help="compile preprocessed units for remote builds")
+    worker_parser.add_argument("--bind", default="127.0.0.1", help="address to listen on, anything but loopback needs --token")
+    worker_parser.add_argument("--port", type=int, default=PORT)
+    worker_parser.add_argument("-j", type=int, help="compilers running at once, defaults to the number of cpus")
+    worker_parser.add_argument("--token", default=os.environ.get("JMAKE_WORKER_TOKEN"), help="shared secret clients have to send")
+    args = parser.parse_args(argv)
+    try:
+        Worker(args.j, args.token).serve(args.bind, args.port)
+    except ValueError as e:
+        parser.error(str(e))
@@ -0,0 +1,78 @@
+from pathlib import Path
+import os
+
+import pytest
+
+from jmake import dirindex
+
+FILES = [ "a.cpp", "b.h", "sub/c.cpp", "sub/deep/d.cpp", "sub/deep/e.h", ".hidden/f.cpp", "other/o.cpp", "inc/i.h" ]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for fname in FILES:
+        p = tmp_path / "src" / fname if not fname.startswith(("other", "inc")) else tmp_path / fname
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text("")
+    (tmp_path / "src" / "empty").mkdir()
+    if hasattr(os, "symlink"):
+        try:
+            os.symlink("..", tmp_path / "src" / "sub" / "loop")
+            os.symlink(tmp_path / "other", tmp_path / "src" / "lnk")
+            os.symlink("nowhere", tmp_path / "src" / "broken")
+        except OSError:
+            pass
+    return tmp_path / "src"
+
+
+def reference(base, pattern, exclude=[]):
+    res = { str(p.absolute()) for p in base.glob(pattern) }
+    for ex in exclude:
+        res -= { str(p.absolute()) for p in base.glob(ex) }
+    return sorted(res)
+
+
+@pytest.mark.parametrize("pattern", [ "*", "*.cpp", "**", "**/", "**/*.cpp", "**/*.h", "sub/**", "sub/**/*.cpp", "*/",
+        "sub/", "sub/*/", "*/*.cpp", "lnk/*.cpp", "**/lnk/*", "sub/loop/*.cpp", "[ab].*", "?.cpp", ".hidden/*" ])
+def test_matches_pathlib(tree, tmp_path, pattern):
+    index = dirindex.DirIndex(tmp_path / "index.json")
+    assert index.glob(tree, [ pattern ]) == reference(tree, pattern)
+
+
+@pytest.mark.parametrize("pattern", [ "../inc/*.h", "../other/*", "sub/../*.cpp", "../src/sub/*.cpp", "*/../a.cpp", "../*/*.h" ])
+def test_parent_segments(tree, tmp_path, pattern):
+    index = dirindex.DirIndex(tmp_path / "index.json")
+    assert index.glob(tree, [ pattern ]) == reference(tree, pattern)
+
+
+def test_excludes(tree, tmp_path):
+    index = dirindex.DirIndex(tmp_path / "index.json")
+    # unlike a pattern an exclude "**" also matches files
+    assert index.glob(tree, [ "**/*.cpp" ], [ "sub/**" ]) == [ str((tree / f).absolute()) for f in [ ".hidden/f.cpp", "a.cpp" ] ]
+    assert index.glob(tree, [ "**/*.cpp" ], [ "*.cpp", "sub/deep/*" ]) == reference(tree, "**/*.cpp", [ "*.cpp", "sub/deep/*" ])
+    assert index.glob(tree, [ "../inc/*" ], [ "../inc/i.h" ]) == []
+
+
+def test_symlink_cycle(tree, tmp_path):
+    if not (tree / "sub" / "loop").is_symlink():
+        pytest.skip("symlinks not available")
+    index = dirindex.DirIndex(tmp_path / "index.json")
+    files = index.glob(tree, [ "**/*.cpp" ])
+    assert str((tree / "lnk" / "o.cpp").absolute()) not in files
+    assert files == reference(tree, "**/*.cpp")
+
+
+def test_index_reused(tree, tmp_path):
+    index = dirindex.DirIndex(tmp_path / "index.json")
+    first = index.glob(tree, [ "**/*.cpp" ])
+    index.save()
+    (tree / "sub" / "new.cpp").write_text("")
+    again = dirindex.DirIndex(tmp_path / "index.json")
+    assert again.glob(tree, [ "**/*.cpp" ]) == sorted(first + [ str((tree / "sub" / "new.cpp").absolute()) ])
+
+
+def test_rebase():
+    assert dirindex.rebase("src", "../inc/*.h") == (Path("inc"), "*.h")
+    assert dirindex.rebase("src", "sub/**/*.cpp") == (Path("src/sub"), "**/*.cpp")
+    assert dirindex.rebase("src", "a.cpp") == (Path("src"), "a.cpp")
+    assert dirindex.rebase("src", "sub/deep/") == (Path("src/sub"), "deep/")
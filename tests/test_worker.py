@@ -0,0 +1,201 @@
+from pathlib import Path
+import subprocess
+import threading
+import socket
+import shutil
+import time
+import sys
+import os
+
+import pytest
+
+import jmake
+from jmake import builder
+from jmake import worker
+
+pytestmark = pytest.mark.skipif(not shutil.which("gcc") or sys.platform == "win32", reason="needs gcc and a posix shell")
+
+# stands in for cc, FAKE_CC_MARKER tells the test a compile started, FAKE_CC_DELAY keeps it running and FAKE_CC_LOG
+# records when it starts and ends
+FAKE_CC = """#!/bin/sh
+if [ "$1" = "--version" ]; then
+    echo "fake cc 1"
+    exit 0
+fi
+if [ -n "$FAKE_CC_MARKER" ]; then
+    touch "$FAKE_CC_MARKER"
+fi
+if [ -n "$FAKE_CC_LOG" ]; then
+    echo start >> "$FAKE_CC_LOG"
+fi
+sleep "${FAKE_CC_DELAY:-0}"
+gcc "$@"
+code=$?
+if [ -n "$FAKE_CC_LOG" ]; then
+    echo end >> "$FAKE_CC_LOG"
+fi
+exit $code
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def fakecc(tmp_path, monkeypatch):
+    bindir = tmp_path / "fakebin"
+    bindir.mkdir()
+    cc = bindir / "cc"
+    cc.write_text(FAKE_CC)
+    cc.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bindir) + os.pathsep + os.environ["PATH"])
+    monkeypatch.chdir(tmp_path)
+    return cc
+
+
+@pytest.fixture
+def workers(fakecc):
+    procs = []
+
+    def start(delay=0, marker=None, fake=True):
+        port = free_port()
+        env = os.environ | { "FAKE_CC_DELAY": str(delay) }
+        if not fake:
+            env["PATH"] = os.pathsep.join([ p for p in env["PATH"].split(os.pathsep) if p != str(fakecc.parent) ])
+        if marker:
+            env["FAKE_CC_MARKER"] = str(marker)
+        proc = subprocess.Popen([ sys.executable, "-m", "jmake", "worker", "--port", str(port), "-j", "1" ], env=env,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        procs.append(proc)
+        for i in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        return (f"127.0.0.1:{port}", proc)
+
+    yield start
+    for proc in procs:
+        proc.kill()
+        proc.wait()
+
+
+def unit(name):
+    src = Path(name + ".c")
+    src.write_text(f"int {name}(void) {{ return 1; }}\n")
+    project = jmake.Project(name, jmake.Target.STATIC_LIBRARY)
+    return builder.CompileAction(project, name, Path("obj", name + ".o"), str(src), "cc", [ "-O1" ], cxx=False)
+
+
+def test_allowlist():
+    assert worker.allowed("-O2")
+    assert worker.allowed("-Wall")
+    assert worker.allowed("-std=c++20")
+    assert worker.allowed("-fno-rtti")
+    for flag in [ "-aux-info", "-MF", "-dumpdir", "-include", "-Wl,-rpath", "-Wp,-MD,x", "-fdump-tree-all", "-o", "-fplugin=x.so", "@args" ]:
+        assert not worker.allowed(flag), flag
+
+
+def test_rejected_flags_write_nothing(tmp_path):
+    w = worker.Worker(1)
+    header = { "protocol": worker.PROTOCOL, "op": "compile", "tool": "gcc", "flags": [ "-aux-info", str(tmp_path / "pwned") ],
+            "name": "a.c", "cxx": False, "cwd": str(tmp_path) }
+    res, data = w.handle(header, b"int a;\n")
+    assert res["status"] == "rejected"
+    assert not (tmp_path / "pwned").exists()
+
+
+def test_token_required_off_loopback():
+    with pytest.raises(ValueError):
+        worker.Worker(1).serve("0.0.0.0", 0)
+
+
+# two workers each take a unit, the one killed mid compile is dropped and its unit compiles locally because the other is busy
+def test_killed_worker_falls_back_to_local(tmp_path, workers):
+    marker = tmp_path / "started"
+    slow, victim = workers(delay=60, marker=marker)
+    fast, _ = workers(delay=2)
+    pool = worker.WorkerPool([ slow, fast ])
+    assert pool.slots() == 2
+
+    actions = [ unit("first"), unit("second") ]
+    for action in actions:
+        action.remote = pool
+    results = {}
+    threads = [ threading.Thread(target=lambda a=action: results.setdefault(a.description, a.run())) for action in actions ]
+    threads[0].start()
+    for i in range(200):
+        if marker.exists():
+            break
+        time.sleep(0.05)
+    assert marker.exists()
+    threads[1].start()
+    time.sleep(0.5)
+    victim.kill()
+    for thread in threads:
+        thread.join(30)
+
+    assert all([ code == 0 for code, out in results.values() ])
+    assert all([ action.outputs[0].is_file() for action in actions ])
+    assert pool.stats == { "remote": 1, "failures": 1 }
+    assert pool.slots() == 1
+
+
+def test_timeout_falls_back_to_local(workers):
+    address, _ = workers(delay=60)
+    pool = worker.WorkerPool([ address ])
+    pool._timeout = 1
+    action = unit("slow")
+    action.remote = pool
+    beg = time.perf_counter()
+    code, out = action.run()
+    assert code == 0
+    assert action.outputs[0].is_file()
+    assert time.perf_counter() - beg < 30
+    assert pool.stats == { "remote": 0, "failures": 1 }
+    assert pool.slots() == 0
+
+
+# a flag outside the allowlist keeps the unit local without dropping the worker, on the client or when a worker refuses it
+@pytest.mark.parametrize("checked", [ True, False ])
+def test_rejected_flags_compile_locally(workers, monkeypatch, checked):
+    address, _ = workers()
+    pool = worker.WorkerPool([ address ])
+    if not checked:
+        monkeypatch.setattr(worker, "allowed", lambda flag: True)
+    action = unit("flags")
+    action.flags = action.flags + [ "-ftemplate-backtrace-limit=0" ]
+    action.remote = pool
+    code, out = action.run()
+    assert code == 0
+    assert action.outputs[0].is_file()
+    assert pool.stats == { "remote": 0, "failures": 0 }
+    assert pool.slots() == 1
+
+
+# no worker has the same compiler, every unit compiles locally and never more of them at once than the local jobs
+def test_local_compiles_capped(tmp_path, workers, monkeypatch):
+    address, _ = workers(fake=False)
+    pool = worker.WorkerPool([ address ])
+    log = tmp_path / "log"
+    monkeypatch.setenv("FAKE_CC_LOG", str(log))
+    monkeypatch.setenv("FAKE_CC_DELAY", "0.2")
+    local = threading.Semaphore(1)
+    actions = [ unit(f"unit{i}") for i in range(3) ]
+    threads = []
+    for action in actions:
+        action.remote = pool
+        action.local = local
+        threads.append(threading.Thread(target=action.run))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert all([ action.outputs[0].is_file() for action in actions ])
+    assert pool.stats["remote"] == 0
+    assert log.read_text().split() == [ "start", "end" ] * 6